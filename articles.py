@@ -1,20 +1,46 @@
-import markdown,yaml
-from markdown.extensions import fenced_code, codehilite
-import os,shutil,re
+import yaml
+import os,shutil,re,hashlib,time
 from dotenv import load_dotenv
+from renderers import get_renderer, parser_fingerprint
+from tags import normalize_tags
+
+# YAML front matter at the top of the markdown files
+FRONT_MATTER_PATTERN = re.compile(r'^---\s*\n(.*?)\n---\s*\n', re.DOTALL)
+
+# ![alt](url "title") and [text](url), [id]: url definitions, src="" and href="" of inline html
+MARKDOWN_REFERENCE_PATTERN = re.compile(
+    r'\]\(\s*<?([^)\s>]+)>?(?:\s+["\'(][^)]*)?\)'
+    r'|^[ ]{0,3}\[[^\]]+\]:\s*<?([^\s>]+)>?'
+    r'|(?:src|href)="([^"]+)"',
+    re.MULTILINE)
+
+def supported_languages():
+    """Languages of the article files (fr.md, en.md...), the SUPPORTED_LANGUAGES setting of the website"""
+    return os.getenv("SUPPORTED_LANGUAGES", "fr,en").split(",")
 
 class Article:
-    def __init__(self,md_file_path=""):
+    def __init__(self,md_file_path="",cache=None,metadata_only=False,front_matters=None):
         self.meta_data = {}
-        self.md_content = ""
         self.md_file_path = md_file_path
         self.prev_path = ""
         self.next_path = ""
         self.path = ""
         self.rel_path = ""
+        self.cache_key = ""
+        self.cache = cache
+        # the body is only read and rendered when html or snippet are used
+        self.has_front_matter = False
+        self._md_content = None if md_file_path else ""
+        self._html = None
+        self._snippet = None
+        # seconds spent rendering markdown, reported by --profile
+        self.markdown_time = 0.0
         
         if md_file_path:
-            self.parse_markdown_article()
+            if metadata_only:
+                self.parse_front_matter_only(front_matters)
+            else:
+                self.parse_markdown_article()
 
         
 
@@ -45,8 +71,8 @@ class Article:
             self.date = date_str
         else:
             self.date = str(date_str) if date_str else ""
-        # tags are separated by commas, split the tags string and strip spaces
-        self.tags = [t.strip() for t in self.meta_data.get("tags", "").split(",")]
+        # tags are separated by commas, empty and repeated tags are dropped
+        self.tags = normalize_tags(self.meta_data.get("tags", ""))
         self.abstract = self.meta_data.get("abstract", "")
         self.thumbnail = self.meta_data.get("thumbnail", "")
         # Add language support
@@ -68,8 +94,9 @@ class Article:
         path_parts = self.md_file_path.split(os.sep)
         
         # Find the article directory (the one before language file)
+        language_files = [f"{language}.md" for language in supported_languages()]
         for i, part in enumerate(path_parts):
-            if part in ['fr.md', 'en.md']:
+            if part in language_files:
                 if i > 0:
                     return path_parts[i-1]
                 break
@@ -83,8 +110,9 @@ class Article:
         
         return os.path.dirname(self.md_file_path)
     
-    def find_translations(self):
-        """Find all available translations of this article"""
+    def find_translations(self, languages=None):
+        """Find all available translations of this article (the website uses its own index)"""
+        languages = languages or supported_languages()
         translations = {}
         translations_dir = self.get_translations_dir()
         
@@ -95,68 +123,298 @@ class Article:
         for filename in os.listdir(translations_dir):
             if filename.endswith('.md'):
                 lang_code = filename.replace('.md', '')
-                if lang_code in ['fr', 'en']:  # Supported languages
+                if lang_code in languages:  # Supported languages
                     translations[lang_code] = os.path.join(translations_dir, filename)
         
         return translations
         if not self.check_metadata():
             print(f"Error: Invalid metadata")
 
+    def read_content(self):
+        with open(self.md_file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        # the parsed article only depends on the file content and the markdown configuration
+        self.cache_key = hashlib.sha256((parser_fingerprint() + content).encode('utf-8')).hexdigest()
+        return content
+
     def parse_markdown_article(self):
         """Parse markdown file, extract meta data and content"""
-        self.html = ""
+        content = self.read_content()
+        match = FRONT_MATTER_PATTERN.match(content)
+        if match:
+            self.has_front_matter = True
+            self._md_content = content[match.end():]
+            self.meta_data = self.parse_front_matter(match.group(1))
+        else:
+            self._md_content = content
+            self.meta_data = {}
+        self.parse_metadata()
+
+    def parse_front_matter_only(self, front_matters=None):
+        """Read the file up to the end of the front matter, the body is read when needed.
+
+        front_matters is a DiskCache of the parsed front matters, keyed by the
+        path, mtime and size of the files: YAML parsing is most of the time
+        spent loading the articles.
+        """
+        key = None
+        if front_matters is not None:
+            stat = os.stat(self.md_file_path)
+            key = f"{self.md_file_path}\0{stat.st_mtime_ns}\0{stat.st_size}"
+            meta_data = front_matters.get(key)
+            if meta_data is not None:
+                self.has_front_matter = True
+                self.meta_data = meta_data
+                self.parse_metadata()
+                return
+        lines = []
         with open(self.md_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+            for line in f:
+                lines.append(line)
+                if len(lines) == 1 and line.rstrip() != '---':
+                    break
+                if len(lines) > 1 and line.rstrip() == '---':
+                    break
+        match = FRONT_MATTER_PATTERN.match("".join(lines))
+        if not match:
+            # no front matter (or an unusual one), read everything
+            self.parse_markdown_article()
+            return
+        self.has_front_matter = True
+        self.meta_data = self.parse_front_matter(match.group(1))
+        if key:
+            front_matters.put(key, self.meta_data)
+        self.parse_metadata()
 
-            # Use regex to extract the YAML front matter
-            yaml_pattern = re.compile(r'^---\s*\n(.*?)\n---\s*\n', re.DOTALL)
-            match = yaml_pattern.match(content)
-
-            if match:
-                yaml_content = match.group(1)
-                md_content = content[match.end():]
-                self.html = markdown.markdown(
-                    md_content,
-                    extensions=[
-                        'fenced_code',
-                        'codehilite',
-                        'tables',
-                        'markdown.extensions.nl2br'
-                    ]
-                )
-                self.snippet = markdown.markdown(md_content)[:200]
-                # Parse YAML content
-                try:
-                    meta_data = yaml.safe_load(yaml_content)
-                except yaml.YAMLError as e:
-                    # If YAML parsing fails, try a custom approach
-                    # some data contains ':' so we split on the first ':' encountered
-                    #print(f"Error parsing YAML in {self.md_file_path}")
-                    meta_data = {}
-                    lines = yaml_content.split('\n')
-                    current_key = None
-                    current_value = []
-                    
-                    for line in lines:
-                        if ':' in line and not line.startswith(' ') and not line.startswith('\t'):
-                            if current_key:
-                                meta_data[current_key] = ' '.join(current_value).strip()
-                            key, value = line.split(':', 1)
-                            current_key = key.strip()
-                            current_value = [value.strip()] if value.strip() else []
-                        elif current_key and line.strip():
-                            current_value.append(line.strip())
-                    
+    def parse_front_matter(self, yaml_content):
+        # Parse YAML content
+        try:
+            meta_data = yaml.safe_load(yaml_content)
+        except yaml.YAMLError as e:
+            # If YAML parsing fails, try a custom approach
+            # some data contains ':' so we split on the first ':' encountered
+            #print(f"Error parsing YAML in {self.md_file_path}")
+            meta_data = {}
+            lines = yaml_content.split('\n')
+            current_key = None
+            current_value = []
+            
+            for line in lines:
+                if ':' in line and not line.startswith(' ') and not line.startswith('\t'):
                     if current_key:
                         meta_data[current_key] = ' '.join(current_value).strip()
+                    key, value = line.split(':', 1)
+                    current_key = key.strip()
+                    current_value = [value.strip()] if value.strip() else []
+                elif current_key and line.strip():
+                    current_value.append(line.strip())
+            
+            if current_key:
+                meta_data[current_key] = ' '.join(current_value).strip()
+        return meta_data
+
+    @property
+    def md_content(self):
+        if self._md_content is None:
+            content = self.read_content()
+            match = FRONT_MATTER_PATTERN.match(content)
+            self._md_content = content[match.end():] if match else content
+        return self._md_content
+
+    @md_content.setter
+    def md_content(self, value):
+        self._md_content = value
+
+    @property
+    def html(self):
+        if self._html is None:
+            self.render_markdown()
+        return self._html
+
+    @html.setter
+    def html(self, value):
+        self._html = value
 
+    @property
+    def snippet(self):
+        if self._snippet is None:
+            # stored apart from the html, listing pages should not load the bodies
+            cached = self.cache.get(self.snippet_cache_key()) if self.cache else None
+            if cached is not None:
+                self._snippet = cached
             else:
-                meta_data = {}
-                md_content = content
+                start = time.perf_counter()
+                self._snippet = get_renderer().render_snippet(self.md_content)[:200] if self.has_front_matter else ""
+                self.markdown_time += time.perf_counter() - start
+                if self.cache:
+                    self.cache.put(self.snippet_cache_key(), self._snippet)
+        return self._snippet
+
+    @snippet.setter
+    def snippet(self, value):
+        self._snippet = value
+
+    def render_markdown(self):
+        """Render the body to html, once, or take it from the cache"""
+        md_content = self.md_content
+        if not self.cache_key:
+            self.read_content()
+        cached = self.cache.get(self.cache_key) if self.cache else None
+        if cached:
+            self._html = cached[1]
+            return
+        if self.has_front_matter:
+            start = time.perf_counter()
+            self._html = get_renderer().render(md_content)
+            self.markdown_time += time.perf_counter() - start
+        else:
+            self._html = ""
+        if self.cache:
+            self.cache.put(self.cache_key, self.cache_entry())
+
+    def is_cached(self):
+        """Tell if the html is already known, without rendering it"""
+        if self._html is not None:
+            return True
+        if not self.cache:
+            return False
+        if not self.cache_key:
+            self.read_content()
+        cached = self.cache.get(self.cache_key)
+        if cached:
+            self._html = cached[1]
+        return cached is not None
+
+    def snippet_cache_key(self):
+        if not self.cache_key:
+            self.read_content()
+        return self.cache_key + "-snippet"
+
+    def __getstate__(self):
+        # the cache is only used by the process that loaded the article
+        state = self.__dict__.copy()
+        state["cache"] = None
+        return state
+
+    def referenced_files(self):
+        """Files of the markdown directory used by this article: images, links and thumbnail"""
+        article_dir = self.get_translations_dir()
+        # scan the markdown source, publishing files must not render the body
+        references = [m.group(1) or m.group(2) or m.group(3) for m in MARKDOWN_REFERENCE_PATTERN.finditer(self.md_content)]
+        if self.thumbnail:
+            references.append(self.thumbnail)
+        files = []
+        for reference in references:
+            # skip absolute urls, anchors and links to other pages of the site
+            if re.match(r'^(?:[a-z][a-z0-9+.-]*:|/|#)', reference, re.IGNORECASE):
+                continue
+            path = os.path.normpath(os.path.join(article_dir, reference.split('#')[0].split('?')[0]))
+            if os.path.isfile(path) and path not in files:
+                files.append(path)
+        return files
+
+    def cache_entry(self):
+        """What is stored in the article cache"""
+        return (self.meta_data, self._html)
+
+    def store(self, html):
+        """Keep the html rendered by another process, and cache it, the snippet is rendered when used"""
+        self.html = html
+        if self.cache:
+            # a metadata-only article has not hashed its file yet
+            if not self.cache_key:
+                self.read_content()
+            self.cache.put(self.cache_key, self.cache_entry())
+
+class ArticleRecord:
+    """What the indexes keep of an article in low-memory mode.
+
+    Only the fields used to sort, group and link the articles are kept.
+    html, snippet and md_content are read again from the cache or from the
+    markdown file each time a page needs them, and are not kept.
+    """
+    __slots__ = ("md_file_path", "cache", "title", "date", "tags", "abstract", "thumbnail", "language",
+                 "path", "prev_path", "next_path", "markdown_time")
+
+    def __init__(self, article):
+        self.md_file_path = article.md_file_path
+        self.cache = article.cache
+        self.title = article.title
+        self.date = article.date
+        self.tags = article.tags
+        self.abstract = article.abstract
+        self.thumbnail = article.thumbnail
+        self.language = article.language
+        self.path = article.path
+        self.prev_path = article.prev_path
+        self.next_path = article.next_path
+        self.markdown_time = article.markdown_time
+
+    # what the metadata snapshot of a sharded build keeps of an article
+    METADATA_FIELDS = ("title", "date", "tags", "abstract", "thumbnail", "language")
+
+    @classmethod
+    def from_metadata(cls, md_file_path, metadata, cache=None):
+        """Record of an article from its metadata fields, without reading its file"""
+        record = cls.__new__(cls)
+        record.md_file_path = md_file_path
+        record.cache = cache
+        for name in cls.METADATA_FIELDS:
+            setattr(record, name, metadata[name])
+        record.path = record.prev_path = record.next_path = ""
+        record.markdown_time = 0.0
+        return record
+
+    def metadata(self):
+        return {name: getattr(self, name) for name in self.METADATA_FIELDS}
+
+    def __repr__(self):
+        return f"ArticleRecord: {self.md_file_path}"
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def body(self):
+        """Article with the same file, its body is loaded on demand then dropped with it"""
+        return Article(self.md_file_path, self.cache, metadata_only=True)
+
+    def with_body(self, name):
+        article = self.body()
+        value = getattr(article, name)
+        self.markdown_time += article.markdown_time
+        return value
+
+    @property
+    def html(self):
+        return self.with_body("html")
+
+    @property
+    def snippet(self):
+        return self.with_body("snippet")
+
+    @property
+    def md_content(self):
+        return self.with_body("md_content")
+
+    @property
+    def html_tags(self):
+        return "".join([f'<a href="../../../../../{self.language}/tags/{tag}.html"><span class="meta-box tag-{i+1}">{tag}</span></a>' for i, tag in enumerate(self.tags)])
+
+    def get_translations_dir(self):
+        return os.path.dirname(self.md_file_path)
+
+    def referenced_files(self):
+        return self.body().referenced_files()
+
+    def is_cached(self):
+        return self.body().is_cached()
 
-            self.meta_data = meta_data
-            self.md_content = md_content
-            self.parse_metadata()
+    def store(self, html):
+        self.body().store(html)
 
 if __name__ == "__main__":
     pass
@@ -0,0 +1,108 @@
+// Search widget of the index pages, over the index written by search.py.
+// Only meta.json and the shards of the words typed are fetched.
+(function () {
+    const script = document.currentScript;
+    const input = document.getElementById('search-input');
+    const results = document.getElementById('search-results');
+    if (!script || !input || !results) {
+        return;
+    }
+    const indexUrl = script.dataset.index;
+    const rootUrl = script.dataset.root;
+    const noResults = script.dataset.empty;
+    const maxResults = 10;
+    let meta = null;
+    const shards = {};
+
+    function loadMeta() {
+        if (!meta) {
+            meta = fetch(indexUrl + 'meta.json').then(response => response.json());
+        }
+        return meta;
+    }
+
+    function loadShard(index, prefix) {
+        if (!index.shards.includes(prefix)) {
+            return Promise.resolve({});
+        }
+        if (!shards[prefix]) {
+            shards[prefix] = fetch(indexUrl + prefix + '.json').then(response => response.json());
+        }
+        return shards[prefix];
+    }
+
+    // same tokenizer as search.py: folding, stop words and stemming rules come from meta.json
+    function fold(text) {
+        return text.toLowerCase().replace(/œ/g, 'oe').replace(/æ/g, 'ae').normalize('NFD').replace(/[\u0300-\u036f]/g, '');
+    }
+
+    function stem(index, word) {
+        for (const [suffix, replacement] of index.rules) {
+            if (word.endsWith(suffix) && word.length - suffix.length >= index.min_stem) {
+                return word.slice(0, word.length - suffix.length) + replacement;
+            }
+        }
+        return word;
+    }
+
+    function terms(index, text) {
+        const words = fold(text).match(/[a-z0-9]+/g) || [];
+        return words.filter(word => word.length > 1 && !index.stop_words.includes(word));
+    }
+
+    function escape(text) {
+        const div = document.createElement('div');
+        div.textContent = text;
+        return div.innerHTML;
+    }
+
+    async function search(query) {
+        const index = await loadMeta();
+        const words = terms(index, query);
+        if (!words.length) {
+            results.innerHTML = '';
+            return;
+        }
+        // every word must match, the last one may still be being typed
+        let scores = null;
+        for (const [i, word] of words.entries()) {
+            const isLast = i === words.length - 1 && !/\s$/.test(query);
+            const term = stem(index, word);
+            const shard = await loadShard(index, term.slice(0, index.prefix));
+            const matches = {};
+            for (const [candidate, postings] of Object.entries(shard)) {
+                if (candidate === term || (isLast && (candidate.startsWith(word) || candidate.startsWith(term)))) {
+                    for (let j = 0; j < postings.length; j += 2) {
+                        matches[postings[j]] = (matches[postings[j]] || 0) + postings[j + 1];
+                    }
+                }
+            }
+            if (scores === null) {
+                scores = matches;
+                continue;
+            }
+            for (const doc of Object.keys(scores)) {
+                if (doc in matches) {
+                    scores[doc] += matches[doc];
+                } else {
+                    delete scores[doc];
+                }
+            }
+        }
+        const found = Object.keys(scores).sort((a, b) => scores[b] - scores[a]).slice(0, maxResults);
+        if (!found.length) {
+            results.innerHTML = '<p>' + escape(noResults) + '</p>';
+            return;
+        }
+        results.innerHTML = found.map(doc => {
+            const [url, title, date] = index.documents[doc];
+            return '<p><a href="' + rootUrl + url + '">' + escape(title) + '</a> - ' + escape(date) + '</p>';
+        }).join('');
+    }
+
+    let timer = null;
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(() => search(input.value), 150);
+    });
+})();
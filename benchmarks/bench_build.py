@@ -0,0 +1,188 @@
+# Benchmark suite on synthetic corpora (see corpus.py): full build, Article
+# parsing, index and tag pages generation and the links of the articles, at
+# several corpus sizes. Every benchmark runs in its own process so that its
+# peak RSS can be measured. Results can be saved as a baseline, and a later
+# run compared to it: the exit status is 1 when a benchmark is slower (or
+# uses more memory) than the baseline by more than the threshold.
+#
+#   python3 benchmarks/bench_build.py --sizes 100,1000 --save-baseline benchmarks/baseline.json
+#   python3 benchmarks/bench_build.py --sizes 100,1000 --compare benchmarks/baseline.json
+import argparse,contextlib,json,os,platform,resource,shutil,subprocess,sys,tempfile,time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from corpus import generate_corpus
+
+BENCHMARKS = ["full_build", "parse", "index_pages", "article_links"]
+
+def configure(md_dir, work_dir):
+    """Environment read by Configuration, the settings of .env are not used"""
+    os.environ.update({
+        "MARKDOWN_DIR": md_dir,
+        "HTML_DIR": os.path.join(work_dir, "html"),
+        "CACHE_DIR": os.path.join(work_dir, "cache"),
+        "PRECOMPRESS": "false",
+    })
+    shutil.rmtree(os.environ["HTML_DIR"], ignore_errors=True)
+    # cold build, except for the variants of the images of assets/ which do not depend on the corpus
+    for name in os.listdir(os.environ["CACHE_DIR"]) if os.path.isdir(os.environ["CACHE_DIR"]) else []:
+        if name != "images":
+            path = os.path.join(os.environ["CACHE_DIR"], name)
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+    from website import Configuration
+    return Configuration()
+
+def loaded_website(conf):
+    """Website with its articles loaded and rendered, as before the generation of the pages"""
+    from website import Website
+    www = Website(conf, use_cache=False)
+    www.manifest.start()
+    www.manifest.set_input("settings", conf.fingerprint())
+    www.output.start()
+    www.publisher.start()
+    www.optimizer.start(os.path.join("assets", conf.css_file))
+    www.assets.start()
+    if www.images:
+        www.images.start()
+    www.init_html()
+    www.init_articles()
+    www.publish_article_files()
+    for article in www.articles:
+        article.html, article.snippet
+    return www
+
+def bench_full_build(md_dir, work_dir, jobs):
+    from website import Website
+    conf = configure(md_dir, work_dir)
+    www = Website(conf, jobs=jobs)
+    start = time.perf_counter()
+    www.build()
+    seconds = time.perf_counter() - start
+    return seconds, sum(len(files) for root, dirs, files in os.walk(conf.html_dir))
+
+def bench_parse(md_dir, work_dir, jobs):
+    from articles import Article
+    configure(md_dir, work_dir)
+    md_files = [os.path.join(root, file) for root, dirs, files in os.walk(md_dir) for file in files if file.endswith(".md")]
+    start = time.perf_counter()
+    for md_file in md_files:
+        Article(md_file).html
+    return time.perf_counter() - start, len(md_files)
+
+def bench_index_pages(md_dir, work_dir, jobs):
+    www = loaded_website(configure(md_dir, work_dir))
+    www.profile.start()
+    start = time.perf_counter()
+    www.generate_index()
+    www.generate_tag_pages()
+    www.output.flush()
+    return time.perf_counter() - start, www.profile.files_written
+
+def bench_article_links(md_dir, work_dir, jobs):
+    www = loaded_website(configure(md_dir, work_dir))
+    pages = [(article.html, article) for article in www.articles]
+    start = time.perf_counter()
+    for html, article in pages:
+        www.link_article_files(html, article, article.path)
+    return time.perf_counter() - start, len(pages)
+
+def run_benchmark(name, md_dir, work_dir, jobs):
+    """Run a benchmark in this process, return its measures"""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        seconds, nb_files = globals()[f"bench_{name}"](md_dir, work_dir, jobs)
+    # kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {"seconds": seconds, "files": nb_files, "files_per_second": nb_files / seconds if seconds else 0, "peak_rss": peak_rss}
+
+def corpus(work_dir, size, args):
+    """Markdown dir of a corpus, generated once per size and parameters"""
+    params = f"{size}-{args.translations}-{args.tags}-{args.code_blocks}-{args.images}"
+    md_dir = os.path.join(work_dir, f"corpus-{params}")
+    if not os.path.exists(os.path.join(md_dir, ".done")):
+        shutil.rmtree(md_dir, ignore_errors=True)
+        print(f"generating a corpus of {size} articles", file=sys.stderr)
+        generate_corpus(md_dir, size, args.translations, args.tags, args.code_blocks, args.images)
+        open(os.path.join(md_dir, ".done"), "w").close()
+    return md_dir
+
+def measure(name, md_dir, work_dir, jobs, repeat):
+    """Best time and highest peak RSS of repeat runs, each in a new process"""
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, os.path.abspath(__file__), "--run", name, "--corpus", md_dir, "--work-dir", work_dir, "--jobs", str(jobs)],
+                                 capture_output=True, text=True, cwd=ROOT)
+        if process.returncode != 0:
+            sys.exit(f"benchmark {name} failed:\n{process.stderr}")
+        result = json.loads(process.stdout)
+        if best is None or result["seconds"] < best["seconds"]:
+            best = dict(result, peak_rss=max(result["peak_rss"], best["peak_rss"] if best else 0))
+        else:
+            best["peak_rss"] = max(best["peak_rss"], result["peak_rss"])
+    return best
+
+def compare(results, baseline, threshold, min_seconds):
+    """Benchmarks of results slower or bigger than in the baseline by more than threshold"""
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            reference = baseline.get(size, {}).get(name)
+            if not reference:
+                continue
+            for measure in ("seconds", "peak_rss"):
+                ratio = result[measure] / reference[measure] if reference[measure] else 1
+                # a few milliseconds more on a short benchmark is noise
+                if measure == "seconds" and result[measure] - reference[measure] < min_seconds:
+                    continue
+                if ratio > threshold:
+                    regressions.append(f"{name} ({size} articles): {measure} {ratio:.2f}x the baseline")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the generator on synthetic corpora")
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="numbers of articles, comma separated")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="benchmarks to run, comma separated")
+    parser.add_argument("--work-dir", help="where corpora and outputs are written (default: a directory in /tmp, kept between runs)")
+    parser.add_argument("--jobs", type=int, default=1, help="--jobs of the full build")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each benchmark, the best time is kept")
+    parser.add_argument("--translations", type=float, default=0.3)
+    parser.add_argument("--tags", type=int, default=200)
+    parser.add_argument("--code-blocks", type=int, default=2)
+    parser.add_argument("--images", type=int, default=1)
+    parser.add_argument("--save-baseline", metavar="FILE", help="write the results to FILE")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with the baseline FILE")
+    parser.add_argument("--threshold", type=float, default=1.25, help="ratio to the baseline above which a result is a regression (default 1.25)")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="time difference below which a benchmark is never a regression (default 0.05)")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or os.path.join(tempfile.gettempdir(), "sitegenerator-bench")
+    if args.run:
+        print(json.dumps(run_benchmark(args.run, args.corpus, os.path.join(work_dir, f"run-{args.run}"), args.jobs)))
+        sys.exit(0)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    results = {}
+    print(f"{'articles':>8} {'benchmark':20} {'seconds':>9} {'files/s':>9} {'peak MB':>8} {'vs baseline':>12}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        md_dir = corpus(work_dir, size, args)
+        for name in args.benchmarks.split(","):
+            result = measure(name, md_dir, work_dir, args.jobs, args.repeat)
+            results.setdefault(str(size), {})[name] = result
+            reference = (baseline or {}).get(str(size), {}).get(name)
+            ratio = f"{result['seconds'] / reference['seconds']:.2f}x" if reference else ""
+            print(f"{size:8} {name:20} {result['seconds']:9.3f} {result['files_per_second']:9.0f} {result['peak_rss'] / 2**20:8.1f} {ratio:>12}", flush=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "machine": platform.machine(), "results": results}, f, indent=1)
+        print(f"baseline written to {args.save_baseline}")
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,92 @@
+# Markdown backends of renderers.py on the articles: golden comparison and
+# throughput. The golden output is the one of a new markdown.markdown() call
+# per article, as articles were rendered before the engines were reused.
+# For each backend, the table shows the articles whose tables, line breaks,
+# fenced code blocks, highlighted code and whole html match the golden
+# output. The exit status is 1 when the default backend does not render
+# every article like the golden output.
+#
+#   python3 benchmarks/bench_renderers.py [--md-dir articles] [--repeat 5]
+import argparse,html,os,re,sys,time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import markdown
+import highlight
+import renderers
+from articles import Article
+from renderers import RENDERERS, DEFAULT_RENDERER, MARKDOWN_EXTENSIONS, AssetLinkExtension
+
+CODE_PATTERN = re.compile(r"<pre[^>]*>(.*?)</pre>", re.DOTALL)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+
+def code_text(page):
+    """Text of the code blocks, without the highlighting markup"""
+    return [html.unescape(TAG_PATTERN.sub("", block)).strip() for block in CODE_PATTERN.findall(page)]
+
+# what each feature looks like in the rendered html
+FEATURES = {
+    "tables": lambda page: re.findall(r"<table>.*?</table>", page, re.DOTALL),
+    "nl2br": lambda page: len(re.findall(r"<br ?/?>", page)),
+    "fenced_code": code_text,
+    "codehilite": lambda page: re.findall(r'<div class="codehilite">.*?</pre></div>', page, re.DOTALL),
+    "html": lambda page: re.sub(r"\s+", " ", page).strip(),
+}
+
+def golden(text):
+    return markdown.markdown(text, extensions=MARKDOWN_EXTENSIONS + [AssetLinkExtension()])
+
+def compare(bodies, reference, name):
+    """Number of articles whose features match the golden output, by feature"""
+    renderers.use(name)
+    render = renderers.get_renderer().render
+    matches = dict.fromkeys(FEATURES, 0)
+    for body, expected in zip(bodies, reference):
+        page = render(body)
+        for feature, extract in FEATURES.items():
+            matches[feature] += extract(page) == extract(expected)
+    return matches
+
+def throughput(bodies, render, repeat):
+    """Best number of articles rendered per second"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for body in bodies:
+            render(body)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return len(bodies) / best
+
+def backend(name):
+    renderers.use(name)
+    return renderers.get_renderer().render
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the markdown backends with the golden output and measure their throughput")
+    parser.add_argument("--md-dir", default="articles")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each throughput measure, the best one is kept")
+    args = parser.parse_args()
+
+    # Pygments is called directly, the highlight cache would hide its cost
+    highlight.install(None)
+    md_files = sorted(os.path.join(root, file) for root, dirs, files in os.walk(args.md_dir) for file in files if file.endswith(".md"))
+    bodies = [Article(md_file).md_content for md_file in md_files]
+    reference = [golden(body) for body in bodies]
+    names = [name for name, renderer in RENDERERS.items() if renderer.available()]
+
+    print(f"{len(bodies)} articles, articles matching the golden output by feature")
+    print(f"{'backend':16} " + " ".join(f"{feature:>12}" for feature in FEATURES))
+    failed = False
+    for name in names:
+        matches = compare(bodies, reference, name)
+        print(f"{name:16} " + " ".join(f"{str(matches[feature]) + '/' + str(len(bodies)):>12}" for feature in FEATURES))
+        failed |= name == DEFAULT_RENDERER and any(count != len(bodies) for count in matches.values())
+    for name in RENDERERS:
+        if name not in names:
+            print(f"{name:16} not installed")
+
+    print(f"\n{'backend':16} {'articles/s':>10}")
+    print(f"{'markdown()':16} {throughput(bodies, golden, args.repeat):10.0f}")
+    for name in names:
+        print(f"{name:16} {throughput(bodies, backend(name), args.repeat):10.0f}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,79 @@
+# Tag indexing cost on a synthetic corpus: the former passes (global
+# articles_by_tag, counts per language, counts again globally, then one
+# grouping per language for the tag pages) against the single-pass TagIndex.
+#
+#   python3 benchmarks/bench_tags.py [nb_articles]
+import os,random,sys,time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from articles import Article
+from tags import TagIndex, normalize_tags
+
+def synthetic_articles(nb_articles, nb_tags=2000, seed=0):
+    rng = random.Random(seed)
+    # a few very common tags and a long tail, like a real blog
+    vocabulary = [f"tag{i}" for i in range(nb_tags)]
+    weights = [1 / (i + 1) for i in range(nb_tags)]
+    articles = []
+    for i in range(nb_articles):
+        article = Article()
+        article.title = f"Article {i}"
+        article.date = f"{rng.randint(2000, 2025)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        article.language = rng.choice(["fr", "fr", "en"])
+        # written by hand: padding spaces and trailing commas
+        article.tags = normalize_tags(", ".join(" " + tag for tag in rng.choices(vocabulary, weights, k=rng.randint(1, 8))) + ",")
+        articles.append(article)
+    return sorted(articles, key=lambda x: x.date, reverse=True)
+
+def count_tags(articles):
+    tag_count = {}
+    for article in articles:
+        for tag in article.tags:
+            if tag not in tag_count:
+                tag_count[tag] = 0
+            tag_count[tag] += 1
+    return [k for k,v in sorted(tag_count.items(), key=lambda x:x[1], reverse=True)]
+
+def former_passes(articles):
+    articles_by_tag = {}
+    articles_by_language = {}
+    for article in articles:
+        articles_by_language.setdefault(article.language, []).append(article)
+        for tag in article.tags:
+            articles_by_tag.setdefault(tag, []).append(article)
+    sorted_tags_by_language = {lang: count_tags(lang_articles) for lang, lang_articles in articles_by_language.items()}
+    sorted_tags = count_tags(articles)
+    articles_by_tag_lang = {}
+    for lang, lang_articles in articles_by_language.items():
+        by_tag = articles_by_tag_lang[lang] = {}
+        for article in lang_articles:
+            for tag in article.tags:
+                by_tag.setdefault(tag, []).append(article)
+    return sorted_tags_by_language, sorted_tags, articles_by_tag_lang
+
+def best_of(function, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+if __name__ == "__main__":
+    nb_articles = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    articles = synthetic_articles(nb_articles)
+    nb_tags = sum(len(article.tags) for article in articles)
+
+    before, (sorted_tags_by_language, sorted_tags, articles_by_tag_lang) = best_of(lambda: former_passes(articles))
+    index = TagIndex()
+    after, _ = best_of(lambda: index.build(articles))
+
+    # same tags, in the same order, with the same articles
+    assert index.sorted_tags == sorted_tags
+    for lang, by_tag in articles_by_tag_lang.items():
+        assert index.tags(lang) == sorted_tags_by_language[lang]
+        assert all(index.get_articles(lang, tag) == tag_articles for tag, tag_articles in by_tag.items())
+
+    print(f"{nb_articles} articles, {nb_tags} tags, {len(index.ids)} distinct")
+    print(f"former passes: {before*1000:8.1f} ms")
+    print(f"TagIndex:      {after*1000:8.1f} ms ({before/after:.1f}x)")
@@ -0,0 +1,46 @@
+# Per-page render cost of the templates: eval of the f-string source (the
+# former Website.get_template + eval) against the compiled TemplateLoader.
+#
+#   python3 benchmarks/bench_templates.py [nb_renders]
+import os,sys,timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from articles import Article
+from templating import TemplateLoader
+
+def fake_article():
+    article = Article()
+    article.title = "Floating point"
+    article.date = "2025-11-10"
+    article.language = "fr"
+    article.abstract = "Comment les nombres flottants sont représentés"
+    article.thumbnail = "IEEE754-fp32.png"
+    article.html_tags = '<a href="../../../../../fr/tags/python.html"><span class="meta-box tag-1">python</span></a>'
+    article.html = "<p>" + "Lorem ipsum dolor sit amet. " * 200 + "</p>"
+    article.prev_path = "../../../2024/10/21/backpropagation/index.html"
+    article.next_path = ""
+    return article
+
+def eval_render(template_dir, filename, context):
+    # what every render used to do: read the file and compile it again
+    with open(os.path.join(template_dir, filename), 'r') as file:
+        html_template = file.read()
+    return eval(f"f'''{html_template}'''", {"os": os}, dict(context))
+
+if __name__ == "__main__":
+    nb_renders = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    article = fake_article()
+    contexts = {
+        "article.html": dict(article=article, css_rel_path="../../../../../assets/style.css", theme_toggle_path="../../../../../assets/theme-toggle.js", hreflang_links="", language_selector="", html_top_tags=""),
+        "embedded_article_summary.html": dict(article=article, subpath="2025/11/10/floating-point/index.html"),
+        "embedded_article.html": dict(article=article, subpath="2025/11/10/floating-point/index.html"),
+        "index.html": dict(page_title="Page 1 of 3", css_path="../assets/style.css", theme_toggle_path="../assets/theme-toggle.js", language_selector="", html_articles="", html_top_tags="", search_widget="", link_prev="", link_next="index-1.html"),
+        "tag.html": dict(css_path="../../assets/style.css", theme_toggle_path="../../assets/theme-toggle.js", tag_name="python", tag_articles="", html_top_tags=""),
+    }
+    loader = TemplateLoader("templates")
+    print(f"{'template':32} {'eval (µs)':>10} {'compiled (µs)':>14} {'speedup':>8}")
+    for filename, context in contexts.items():
+        assert eval_render("templates", filename, context) == loader.render(filename, **context)
+        before = timeit.timeit(lambda: eval_render("templates", filename, context), number=nb_renders) / nb_renders
+        after = timeit.timeit(lambda: loader.render(filename, **context), number=nb_renders) / nb_renders
+        print(f"{filename:32} {before*1e6:10.1f} {after*1e6:14.1f} {before/after:7.1f}x")
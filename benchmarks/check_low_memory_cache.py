@@ -0,0 +1,50 @@
+# Check of the article cache in a low-memory parallel build: the bodies
+# rendered by the worker processes are stored under the key of their
+# markdown file, so the pages and a second build take every body from the
+# cache instead of rendering it again. The exit status is 1 when a check
+# fails.
+#
+#   python3 benchmarks/check_low_memory_cache.py [--articles 40] [--jobs 4]
+import argparse,os,sqlite3,sys,tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from corpus import generate_corpus
+
+def build(md_dir, work_dir, html_name, jobs):
+    """Low-memory parallel build, return its article cache"""
+    os.environ.update({
+        "MARKDOWN_DIR": md_dir,
+        "HTML_DIR": os.path.join(work_dir, html_name),
+        "CACHE_DIR": os.path.join(work_dir, "cache"),
+        "PRECOMPRESS": "false",
+    })
+    from website import Configuration, Website
+    www = Website(Configuration(), jobs=jobs, low_memory=True)
+    www.build()
+    return www
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that a low-memory parallel build renders each article body once and caches it")
+    parser.add_argument("--articles", type=int, default=40)
+    parser.add_argument("--jobs", type=int, default=4)
+    args = parser.parse_args()
+
+    os.chdir(ROOT)
+    with tempfile.TemporaryDirectory() as work_dir:
+        md_dir = os.path.join(work_dir, "md")
+        generate_corpus(md_dir, args.articles)
+        cold = build(md_dir, work_dir, "html", args.jobs)
+        connection = sqlite3.connect(os.path.join(work_dir, "cache", "articles.sqlite"))
+        assert connection.execute("SELECT COUNT(*) FROM articles WHERE key = ''").fetchone()[0] == 0, "a body was cached without the key of its file"
+        for article in cold.articles:
+            body = article.body()
+            body.read_content()
+            assert connection.execute("SELECT COUNT(*) FROM articles WHERE key = ?", (body.cache_key,)).fetchone()[0] == 1, f"{article.md_file_path}: body not cached under its key"
+        connection.close()
+
+        # a new process with the same cache, as the next build
+        warm = build(md_dir, work_dir, "html-warm", args.jobs)
+        assert warm.cache.misses == 0, f"second build: {warm.cache.misses} article cache misses"
+        assert warm.cache.hits >= len(warm.articles), f"second build: {warm.cache.hits} hits for {len(warm.articles)} articles"
+    print(f"ok: {len(cold.articles)} articles, every body cached once and read from the cache by the next build")
@@ -0,0 +1,62 @@
+# Check of the default markdown backend against the golden output, a new
+# markdown.markdown() call per document: tables, line breaks, fenced code
+# blocks, highlighted code and the whole html must be the same, on a sample
+# using each of them and on every article. The exit status is 1 when a
+# check fails.
+#
+#   python3 benchmarks/check_renderers.py [--md-dir articles]
+import argparse,os,sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import highlight
+import renderers
+from articles import Article
+from renderers import DEFAULT_RENDERER
+from bench_renderers import FEATURES, golden
+
+SAMPLE = """# Sample
+
+| Backend | Tables |
+|---------|--------|
+| python-markdown | yes |
+
+First line
+second line, after a line break
+
+```python
+def render(text):
+    return text.upper()
+```
+
+    :::python
+    print("indented code block")
+
+<div class="note">raw <em>html</em></div>
+"""
+
+def check(name, text, render):
+    expected = golden(text)
+    page = render(text)
+    for feature, extract in FEATURES.items():
+        assert extract(page) == extract(expected), f"{name}: {feature} differs from markdown.markdown()"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the default markdown backend renders like markdown.markdown()")
+    parser.add_argument("--md-dir", default="articles")
+    args = parser.parse_args()
+
+    highlight.install(None)
+    renderers.use(DEFAULT_RENDERER)
+    render = renderers.get_renderer().render
+    # the sample exercises every feature, a check cannot pass on an empty match
+    expected = golden(SAMPLE)
+    for feature, extract in FEATURES.items():
+        assert extract(expected), f"sample: no {feature} in the golden output"
+    check("sample", SAMPLE, render)
+    # rendering twice checks that the reused engine is reset between documents
+    check("sample, rendered again", SAMPLE, render)
+
+    md_files = sorted(os.path.join(root, file) for root, dirs, files in os.walk(args.md_dir) for file in files if file.endswith(".md"))
+    for md_file in md_files:
+        check(md_file, Article(md_file).md_content, render)
+    print(f"ok: {DEFAULT_RENDERER} renders the sample and {len(md_files)} articles like markdown.markdown()")
@@ -0,0 +1,85 @@
+# Synthetic corpus of articles with the layout of articles/:
+# YYYY/MM/DD/slug/fr.md, plus en.md for the translated ones, and images.
+#
+#   python3 benchmarks/corpus.py DIR NB_ARTICLES [--translations 0.3] [--tags 200] [--code-blocks 2] [--images 1]
+import argparse,datetime,os,random,struct,zlib
+
+WORDS = """lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore
+et dolore magna aliqua modele reseau neurones apprentissage gradient donnees memoire processeur calcul
+compilation python rust noyau linux serveur cache latence debit vecteur matrice tenseur precision""".split()
+
+CODE = '''```python
+def train(model, data, epochs=10):
+    for epoch in range(epochs):
+        loss = model.step(data)
+        print(f"epoch {epoch}: {loss:.3f}")
+```
+'''
+
+def png(width, height, seed):
+    """Small valid png, without Pillow"""
+    rng = random.Random(seed)
+    rows = b"".join(b"\0" + bytes(rng.randrange(256) for _ in range(width * 3)) for _ in range(height))
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+def sentence(rng, nb_words):
+    return " ".join(rng.choice(WORDS) for _ in range(nb_words)).capitalize() + "."
+
+def article(rng, title, date, tags, language, nb_code_blocks, images):
+    paragraphs = [" ".join(sentence(rng, rng.randint(8, 20)) for _ in range(5)) for _ in range(6)]
+    for i in range(nb_code_blocks):
+        paragraphs.insert(rng.randint(0, len(paragraphs)), CODE)
+    for image in images:
+        paragraphs.insert(rng.randint(0, len(paragraphs)), f"![{image}]({image})")
+    front_matter = [
+        "---",
+        f'title: "{title}"',
+        f"date: {date}",
+        f'tags: "{", ".join(tags)}"',
+        f'abstract: "{sentence(rng, 15)}"',
+    ]
+    if images:
+        front_matter.append(f'thumbnail: "{images[0]}"')
+    front_matter += [f'language: "{language}"', "---", ""]
+    return "\n".join(front_matter) + "\n\n".join(paragraphs) + "\n"
+
+def generate_corpus(md_dir, nb_articles, translations=0.3, nb_tags=200, code_blocks=2, images=1, seed=0):
+    """Write nb_articles articles in md_dir, return the number of markdown files"""
+    rng = random.Random(seed)
+    tags = [f"tag{i}" for i in range(nb_tags)]
+    # a few common tags and a long tail
+    weights = [1 / (i + 1) for i in range(nb_tags)]
+    image_data = [png(64, 48, i) for i in range(4)]
+    start = datetime.date(2000, 1, 1)
+    nb_files = 0
+    for i in range(nb_articles):
+        date = start + datetime.timedelta(days=rng.randrange(9000))
+        slug = f"article-{i}"
+        article_dir = os.path.join(md_dir, f"{date:%Y/%m/%d}", slug)
+        os.makedirs(article_dir, exist_ok=True)
+        article_images = [f"image-{j}.png" for j in range(images)]
+        for j, image in enumerate(article_images):
+            with open(os.path.join(article_dir, image), "wb") as f:
+                f.write(image_data[(i + j) % len(image_data)])
+        article_tags = list(dict.fromkeys(rng.choices(tags, weights, k=rng.randint(1, 6))))
+        languages = ["fr", "en"] if rng.random() < translations else ["fr"]
+        for language in languages:
+            with open(os.path.join(article_dir, f"{language}.md"), "w", encoding="utf-8") as f:
+                f.write(article(rng, f"Article {i} ({language})", date, article_tags, language, code_blocks, article_images))
+            nb_files += 1
+    return nb_files
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic corpus of articles")
+    parser.add_argument("md_dir")
+    parser.add_argument("nb_articles", type=int)
+    parser.add_argument("--translations", type=float, default=0.3, help="share of the articles that also have an en.md")
+    parser.add_argument("--tags", type=int, default=200, help="number of distinct tags")
+    parser.add_argument("--code-blocks", type=int, default=2, help="fenced code blocks per article")
+    parser.add_argument("--images", type=int, default=1, help="images per article")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    nb_files = generate_corpus(args.md_dir, args.nb_articles, args.translations, args.tags, args.code_blocks, args.images, args.seed)
+    print(f"{args.nb_articles} articles, {nb_files} markdown files written to {args.md_dir}")
@@ -0,0 +1,85 @@
+import os
+import pickle
+import sqlite3
+import time
+
+class DiskCache:
+    """Persistent key/value store kept in a sqlite database.
+
+    Values are pickled. Each table is bounded in size: when it grows over
+    max_size bytes the least recently used entries are evicted. A copy sent
+    to another process is read-only, only the process that created the
+    cache writes to it.
+    """
+    def __init__(self, path, table, max_size):
+        self.path = path
+        self.table = table
+        self.max_size = max_size
+        self.connection = None
+        self.read_only = False
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.connection = sqlite3.connect(self.path, timeout=30)
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, value BLOB, size INTEGER, last_used REAL)")
+        return self.connection
+
+    def get(self, key):
+        row = self.connect().execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if not self.read_only:
+            self.connection.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        if self.read_only:
+            return
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.connect().execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?, ?)", (key, blob, len(blob), time.time()))
+
+    def evict(self):
+        """Remove the least recently used entries until the table fits in max_size"""
+        connection = self.connect()
+        total = connection.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_size:
+            return 0
+        evicted = 0
+        for key, size in connection.execute(f"SELECT key, size FROM {self.table} ORDER BY last_used").fetchall():
+            if total <= self.max_size:
+                break
+            connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        return evicted
+
+    def commit(self):
+        """Make the entries written so far visible to the other processes"""
+        if self.connection is not None and not self.read_only:
+            self.connection.commit()
+
+    def close(self):
+        if self.connection is None:
+            return
+        if not self.read_only:
+            self.evict()
+            self.connection.commit()
+        self.connection.close()
+        self.connection = None
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f"{self.table} cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+    def __getstate__(self):
+        # sqlite connections cannot be pickled or copied, other processes open their own
+        state = self.__dict__.copy()
+        state["connection"] = None
+        state["read_only"] = True
+        return state
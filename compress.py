@@ -0,0 +1,112 @@
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = (".html", ".css", ".js", ".svg", ".xml", ".json", ".txt")
+
+def gzip_compress(data):
+    # mtime=0 so that the same input always gives the same .gz
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+def brotli_compress(data):
+    return brotli.compress(data, quality=11)
+
+def encoders():
+    """Suffix and compression function of each precompressed format nginx can serve"""
+    formats = [(".gz", gzip_compress)]
+    if brotli is not None:
+        formats.append((".br", brotli_compress))
+    return formats
+
+def is_copy_of(out, src_stat):
+    """Whether a compressed copy was made from the file as it is, copies get the mtime of their source"""
+    try:
+        return os.stat(out).st_mtime_ns == src_stat.st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def precompress_file(path):
+    """Write the compressed copies of a file, return the number of (written, up to date, not smaller, saved bytes)"""
+    nb_written = nb_up_to_date = nb_not_smaller = saved = 0
+    data = None
+    src_stat = os.stat(path)
+    for suffix, compress in encoders():
+        out = path + suffix
+        # published files keep the mtime of their source, a restored older version is not older than its copy
+        if is_copy_of(out, src_stat):
+            nb_up_to_date += 1
+            continue
+        if data is None:
+            with open(path, 'rb') as f:
+                data = f.read()
+        compressed = compress(data)
+        if len(compressed) >= len(data):
+            # serving the original is cheaper
+            if os.path.exists(out):
+                os.remove(out)
+            nb_not_smaller += 1
+            continue
+        tmp = out + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(compressed)
+        os.utime(tmp, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+        os.replace(tmp, out)
+        nb_written += 1
+        saved += len(data) - len(compressed)
+    return nb_written, nb_up_to_date, nb_not_smaller, saved
+
+def compressible_files(html_dir, keep_outdated=True):
+    """List the compressible files of html_dir and delete the compressed copies that would be served stale"""
+    paths = []
+    for root, dirs, files in os.walk(html_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            original, suffix = os.path.splitext(path)
+            if suffix in (".gz", ".br") and original.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                # compressed copy of a file that no longer exists, or that was modified
+                if not os.path.exists(original) or (not keep_outdated and not is_copy_of(path, os.stat(original))):
+                    os.remove(path)
+            elif file.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                paths.append(path)
+    return paths
+
+def remove_outdated_copies(html_dir, paths=None):
+    """Used when precompression is disabled, so that nginx never serves an outdated copy.
+
+    paths limits the check to the copies of these files, the ones a build wrote.
+    """
+    if paths is None:
+        compressible_files(html_dir, keep_outdated=False)
+        return
+    for path in paths:
+        for suffix, compress in encoders():
+            out = path + suffix
+            if os.path.exists(out) and not (os.path.exists(path) and is_copy_of(out, os.stat(path))):
+                os.remove(out)
+
+def remove_copies(html_dir):
+    """Delete every compressed copy, a full build without precompression publishes none"""
+    for root, dirs, files in os.walk(html_dir):
+        for file in files:
+            original, suffix = os.path.splitext(file)
+            if suffix in (".gz", ".br") and original.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                os.remove(os.path.join(root, file))
+
+def precompress(html_dir, jobs=None, paths=None):
+    """Write .gz (and .br when brotli is installed) next to every compressible file of html_dir, or of paths only"""
+    if paths is None:
+        paths = compressible_files(html_dir)
+    else:
+        paths = [path for path in paths if path.lower().endswith(COMPRESSIBLE_EXTENSIONS) and os.path.isfile(path)]
+
+    # zlib and brotli release the GIL, threads are enough, one per core by default
+    with ThreadPoolExecutor(jobs or os.cpu_count()) as pool:
+        results = list(pool.map(precompress_file, paths))
+    nb_written, nb_up_to_date, nb_not_smaller, saved = [sum(r[i] for r in results) for i in range(4)]
+    formats = ", ".join(suffix for suffix, compress in encoders())
+    print(f"precompressed ({formats}): {nb_written} written, {nb_up_to_date} up to date, {nb_not_smaller} not smaller, {saved} bytes saved")
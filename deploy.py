@@ -1,29 +1,160 @@
-# Deploy to remote server
-import subprocess
+        # Deploy to remote server
+import argparse
+import io
+import json
 import os
+import shlex
+import subprocess
+import tarfile
+import time
 from dotenv import load_dotenv
+from manifest import hash_file
+
+# Layout of the site directory on the target:
+#   releases/20250101_120000/          one directory per deployment
+#   releases/20250101_120000.manifest.json   hash of every file of the release
+#   html -> releases/20250101_120000   symlink switched atomically
+MANIFEST_SUFFIX = ".manifest.json"
+REMOVED_LIST = ".deploy-removed"
+NEW_MANIFEST = ".deploy-manifest.json"
+
+class SshTarget:
+    """Site directory on a remote server, reached through ssh"""
+    def __init__(self, host, site_dir):
+        self.host = host
+        self.site_dir = site_dir
+
+    def popen(self, script, **kwargs):
+        return subprocess.Popen(["ssh", self.host, script], **kwargs)
+
+    def __str__(self):
+        return f"{self.host}:{self.site_dir}"
+
+class LocalTarget:
+    """Site directory on this machine, used to test deployments"""
+    def __init__(self, site_dir):
+        self.site_dir = os.path.abspath(site_dir)
+
+    def popen(self, script, **kwargs):
+        return subprocess.Popen(["sh", "-c", script], **kwargs)
+
+    def __str__(self):
+        return self.site_dir
+
+def in_site_dir(target, script):
+    """Shell script run in the site directory, stopping at the first error"""
+    return f"set -e\nmkdir -p {shlex.quote(target.site_dir)}\ncd {shlex.quote(target.site_dir)}\n{script}"
+
+def run(target, script, data=b""):
+    """Run a shell script in the site directory of the target, return its output"""
+    proc = target.popen(in_site_dir(target, script), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    output, _ = proc.communicate(data)
+    if proc.returncode != 0:
+        raise RuntimeError(f"command failed on {target} with exit code {proc.returncode}")
+    return output
+
+def local_manifest(html_dir):
+    """Hash of every file of the local html directory, by relative path"""
+    manifest = {}
+    for root, dirs, files in os.walk(html_dir):
+        for file in files:
+            path = os.path.join(root, file)
+            manifest[os.path.relpath(path, html_dir)] = hash_file(path)
+    return manifest
 
-def deploy():
+def remote_manifest(target):
+    """Manifest of the release currently served by the target"""
+    output = run(target, f'if [ -L html ]; then cat "$(readlink html){MANIFEST_SUFFIX}" 2>/dev/null || true; fi')
+    return json.loads(output) if output.strip() else {}
+
+class CountingWriter(io.RawIOBase):
+    """Count the bytes written to a pipe"""
+    def __init__(self, out):
+        self.out = out
+        self.nb_bytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.out.write(data)
+        self.nb_bytes += len(data)
+        return len(data)
+
+def add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    tar.addfile(info, io.BytesIO(data))
+
+def send_release(target, html_dir, release, manifest, changed, removed, keep_releases):
+    """Create the new release from the current one and the changed files, in a single stream"""
+    new = shlex.quote(f"releases/{release}")
+    script = f"""
+mkdir -p releases
+current=$(readlink html 2>/dev/null || true)
+test ! -e {new}
+# start from a hardlinked copy of the current release, files are unlinked before being replaced
+if [ -n "$current" ] && [ -d "$current" ]; then cp -al "$current" {new}; else mkdir {new}; fi
+tar -xzUf - -C {new}
+(cd {new} && xargs -0 rm -f -- < {REMOVED_LIST} && rm {REMOVED_LIST})
+find {new} -mindepth 1 -type d -empty -delete
+mv {new}/{NEW_MANIFEST} {new}{MANIFEST_SUFFIX}
+# first delta deployment over a plain html directory: keep it as a backup
+if [ -d html ] && [ ! -L html ]; then mv html html_backup_$(date +%Y%m%d_%H%M%S); fi
+ln -sfn {new} html.new
+mv -T html.new html
+# remove old releases
+ls -1d releases/*/ | sort | head -n -{keep_releases} | while read old; do rm -rf "$old" "${{old%/}}{MANIFEST_SUFFIX}"; done
+"""
+    proc = target.popen(in_site_dir(target, script), stdin=subprocess.PIPE)
+    writer = CountingWriter(proc.stdin)
+    with tarfile.open(fileobj=writer, mode="w|gz") as tar:
+        for path in changed:
+            tar.add(os.path.join(html_dir, path), arcname=path, recursive=False)
+        add_bytes(tar, REMOVED_LIST, b"".join(path.encode("utf-8") + b"\0" for path in removed))
+        add_bytes(tar, NEW_MANIFEST, json.dumps(manifest, indent=1, sort_keys=True).encode("utf-8"))
+    proc.stdin.close()
+    if proc.wait() != 0:
+        raise RuntimeError(f"deployment failed on {target} with exit code {proc.returncode}")
+    return writer.nb_bytes
+
+def deploy(target=None, dry_run=False):
     load_dotenv()
-    
+
     server = os.getenv("SERVER")
     site_dir = os.getenv("SITE_DIR")
     html_dir = os.getenv("HTML_DIR", "html")
-    
-    if not server or not site_dir:
-        print("Error: SERVER and SITE_DIR must be set in .env file")
+    ssh_user = os.getenv("SSH_USER", "ubuntu")
+    keep_releases = int(os.getenv("KEEP_RELEASES", 5))
+
+    if target is None:
+        if not server or not site_dir:
+            print("Error: SERVER and SITE_DIR must be set in .env file")
+            return
+        target = SshTarget(f"{ssh_user}@{server}", site_dir)
+
+    manifest = local_manifest(html_dir)
+    previous = remote_manifest(target)
+    changed = sorted(path for path, digest in manifest.items() if previous.get(path) != digest)
+    removed = sorted(set(previous) - set(manifest))
+    size_changed = sum(os.path.getsize(os.path.join(html_dir, path)) for path in changed)
+    size_skipped = sum(os.path.getsize(os.path.join(html_dir, path)) for path in manifest if path not in changed)
+    print(f"{len(changed)} files to send ({size_changed} bytes), {len(manifest) - len(changed)} unchanged ({size_skipped} bytes skipped), {len(removed)} to delete")
+    if dry_run:
         return
-    
-    # Backup remote html directory
-    backup_cmd = f"ssh ubuntu@{server} 'cd {site_dir} && mv html html_backup_$(date +%Y%m%d_%H%M%S)'"
-    subprocess.run(backup_cmd, shell=True)
-    
-    # Copy local html to remote
-    copy_cmd = f"scp -r {html_dir} ubuntu@{server}:{site_dir}/"
-    subprocess.run(copy_cmd, shell=True)
-    
-    print(f"Deployment completed to {server}:{site_dir}")
+    if not changed and not removed:
+        print(f"{target} is up to date")
+        return
+
+    release = time.strftime("%Y%m%d_%H%M%S")
+    nb_sent = send_release(target, html_dir, release, manifest, changed, removed, keep_releases)
+    print(f"Sent {nb_sent} bytes (compressed), skipped {size_skipped} bytes")
+    print(f"Deployment completed to {target}, release {release}")
 
 if __name__ == "__main__":
-    deploy()
-    
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Deploy the html directory, sending only the files that changed")
+    parser.add_argument("--local", metavar="DIR", help="deploy to a local directory instead of SERVER:SITE_DIR")
+    parser.add_argument("--dry-run", action="store_true", help="only show what would be sent")
+    args = parser.parse_args()
+    deploy(LocalTarget(args.local) if args.local else None, args.dry_run)
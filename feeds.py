@@ -0,0 +1,114 @@
+import json
+import os
+import re
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape, quoteattr
+from manifest import hash_text
+
+# urls per sitemap file, the limit of the sitemap protocol
+SITEMAP_MAX_URLS = 50000
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+def iso_datetime(date):
+    """RFC 3339 date and time of a YYYY-MM-DD front matter date, "" for other formats"""
+    return f"{date}T00:00:00Z" if DATE_PATTERN.match(str(date)) else ""
+
+class ContentDates:
+    """When the content of each article last changed, kept across builds.
+
+    The rendered html of an article is only hashed again when its markdown
+    file changed, and its date only moves when that hash changes: the
+    lastmod of the sitemaps and the updated of the feeds do not follow the
+    templates, the assets or the build time. An article seen for the first
+    time gets the date of its front matter.
+    """
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.previous = {}
+        self.dates = {}
+        self.now = ""
+
+    def start(self, known=None):
+        """known: entries of the articles computed by the shards of a sharded build"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.previous = json.load(f)
+        except (OSError, ValueError):
+            self.previous = {}
+        self.dates = dict(known or {})
+        self.now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def updated(self, article):
+        md_file = article.md_file_path
+        if md_file in self.dates:
+            return self.dates[md_file]["updated"]
+        source = self.manifest.input_hash(md_file)
+        entry = self.previous.get(md_file)
+        if entry is None or entry["source"] != source:
+            content = hash_text("\0".join([article.title, str(article.abstract), " ".join(article.tags), article.html]))
+            if entry is not None and entry["content"] == content:
+                updated = entry["updated"]
+            elif entry is not None:
+                updated = self.now
+            else:
+                updated = iso_datetime(article.date) or self.now
+            entry = {"source": source, "content": content, "updated": updated}
+        self.dates[md_file] = entry
+        return entry["updated"]
+
+    def save(self):
+        """Keep the articles of this build only"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.dates, f, sort_keys=True)
+
+def atom_feed(title, feed_url, page_url, language, author, entries):
+    """Parts of an Atom feed, entries are (url, title, published, updated, summary, tags) tuples"""
+    updated = max((entry[3] for entry in entries), default="")
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield f'<feed xmlns="http://www.w3.org/2005/Atom" xml:lang={quoteattr(language)}>\n'
+    yield f"  <title>{escape(title)}</title>\n"
+    yield f"  <id>{escape(feed_url)}</id>\n"
+    yield f'  <link rel="self" type="application/atom+xml" href={quoteattr(feed_url)}/>\n'
+    yield f'  <link rel="alternate" type="text/html" href={quoteattr(page_url)}/>\n'
+    yield f"  <updated>{updated}</updated>\n"
+    yield f"  <author><name>{escape(author)}</name></author>\n"
+    for url, entry_title, published, entry_updated, summary, tags in entries:
+        yield "  <entry>\n"
+        yield f"    <title>{escape(entry_title)}</title>\n"
+        yield f"    <id>{escape(url)}</id>\n"
+        yield f'    <link rel="alternate" type="text/html" href={quoteattr(url)}/>\n'
+        if published:
+            yield f"    <published>{published}</published>\n"
+        yield f"    <updated>{entry_updated}</updated>\n"
+        if summary:
+            yield f"    <summary>{escape(str(summary))}</summary>\n"
+        for tag in tags:
+            yield f"    <category term={quoteattr(tag)}/>\n"
+        yield "  </entry>\n"
+    yield "</feed>\n"
+
+def sitemap(urls):
+    """Parts of a sitemap, urls are (url, lastmod, [(language, alternate url)]) tuples"""
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:xhtml="http://www.w3.org/1999/xhtml">\n'
+    for url, lastmod, alternates in urls:
+        yield f"  <url>\n    <loc>{escape(url)}</loc>\n"
+        if lastmod:
+            yield f"    <lastmod>{lastmod}</lastmod>\n"
+        for language, alternate in alternates:
+            yield f'    <xhtml:link rel="alternate" hreflang={quoteattr(language)} href={quoteattr(alternate)}/>\n'
+        yield "  </url>\n"
+    yield "</urlset>\n"
+
+def sitemap_index(sitemaps):
+    """Parts of a sitemap index, sitemaps are (url, lastmod) tuples"""
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for url, lastmod in sitemaps:
+        yield f"  <sitemap>\n    <loc>{escape(url)}</loc>\n"
+        if lastmod:
+            yield f"    <lastmod>{lastmod}</lastmod>\n"
+        yield "  </sitemap>\n"
+    yield "</sitemapindex>\n"
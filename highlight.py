@@ -0,0 +1,79 @@
+import copy
+import hashlib
+import json
+import pygments
+from pygments import highlight as pygments_highlight
+from markdown.extensions import codehilite
+
+# bump when the cached html changes for the same inputs
+HIGHLIGHT_VERSION = 1
+
+class HighlightCache:
+    """Html of the code blocks highlighted by Pygments, kept across builds.
+
+    codehilite, which fenced_code also uses, calls Pygments through its
+    module-level highlight function: install() routes it through this cache.
+    Entries are keyed by the lexer, the formatter and their options, the
+    Pygments version and the hash of the code, in a DiskCache with LRU
+    eviction. In worker processes the DiskCache is read-only: the blocks
+    highlighted there are kept in new_entries and sent back with drain().
+    """
+    def __init__(self, cache):
+        self.cache = cache
+        self.new_entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, code, lexer, formatter):
+        settings = json.dumps([HIGHLIGHT_VERSION, pygments.__version__,
+                               type(lexer).__module__, type(lexer).__name__, lexer.options,
+                               type(formatter).__module__, type(formatter).__name__, formatter.options],
+                              sort_keys=True, default=str)
+        return hashlib.sha256((settings + "\0" + code).encode("utf-8")).hexdigest()
+
+    def highlight(self, code, lexer, formatter):
+        key = self.key(code, lexer, formatter)
+        html = self.new_entries.get(key) or self.cache.get(key)
+        if html is not None:
+            self.hits += 1
+            return html
+        self.misses += 1
+        html = pygments_highlight(code, lexer, formatter)
+        if self.cache.read_only:
+            self.new_entries[key] = html
+        else:
+            self.cache.put(key, html)
+        return html
+
+    def reader(self):
+        """Read-only copy for a worker process, with its own connection"""
+        return HighlightCache(copy.copy(self.cache))
+
+    def drain(self):
+        """Entries highlighted and counters since the last call, for the process that owns the cache"""
+        state = (self.new_entries, self.hits, self.misses)
+        self.new_entries = {}
+        self.hits = self.misses = 0
+        return state
+
+    def merge(self, state):
+        entries, hits, misses = state
+        for key, html in entries.items():
+            self.cache.put(key, html)
+        self.hits += hits
+        self.misses += misses
+
+    def commit(self):
+        self.cache.commit()
+
+    def close(self):
+        self.cache.close()
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = 100 * self.hits / total if total else 0
+        return f"highlight cache: {self.hits} hits, {self.misses} misses ({rate:.0f}% hit rate)"
+
+def install(highlights):
+    """Make codehilite use the cache, or call Pygments directly again when highlights is None"""
+    codehilite.highlight = highlights.highlight if highlights else pygments_highlight
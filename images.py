@@ -0,0 +1,142 @@
+import os
+import re
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:
+    Image = None
+
+RESIZABLE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+# bump when the variants change for the same source images
+IMAGES_VERSION = 2
+# exif orientation, and its values for the images stored rotated by a quarter turn
+ORIENTATION_TAG = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+# <img ...> tag, without its closing "/>" or ">"
+IMG_PATTERN = re.compile(r'(<img\b[^>]*?)\s*(/?>)', re.IGNORECASE)
+SRC_PATTERN = re.compile(r'\ssrc="([^"]+)"', re.IGNORECASE)
+
+def is_resizable(path):
+    return path.lower().endswith(RESIZABLE_EXTENSIONS)
+
+def resolve(base_dir, url):
+    """Path relative to the html dir of a relative url found in a page of base_dir"""
+    path = os.path.normpath(os.path.join(base_dir, url))
+    # like browsers, ignore the ".." going above the root of the site
+    while path.startswith("../"):
+        path = path[3:]
+    return path
+
+class ResponsiveImages:
+    """Resized variants of the published images, for srcset.
+
+    Variants are encoded once in the cache directory, keyed by the hash of
+    the source image and the width, then published next to the image, named
+    after its name and extension (image-png-480w.webp, image-png-800w.webp...)
+    so that image.png and image.jpg get their own. Only widths smaller than
+    the original are produced. Sizes and variants follow the exif orientation
+    of the image, like browsers displaying the original.
+    """
+    def __init__(self, cache_dir, publisher, widths):
+        self.cache_dir = os.path.join(cache_dir, "images")
+        self.publisher = publisher
+        self.widths = widths
+        self.webp = features.check("webp")
+        # source hash -> (width, height, has alpha)
+        self.sizes = {}
+        # published path, relative to the html dir -> (source, width, height, [(variant name, width)])
+        self.info = {}
+
+    @staticmethod
+    def available():
+        return Image is not None
+
+    def start(self):
+        self.info = {}
+        # pages list the names and sizes of the variants
+        self.publisher.manifest.set_input("responsive_images", str(IMAGES_VERSION))
+
+    def variant_format(self, has_alpha):
+        if self.webp:
+            return "webp", "WEBP"
+        # jpeg has no transparency, keep the original in that case
+        return (None, None) if has_alpha else ("jpg", "JPEG")
+
+    def prepare(self, src, html_dir, rel_path, publish=True):
+        """Publish the variants of the image src, published at rel_path in html_dir.
+
+        With publish=False the variants are only listed for the srcset of the
+        pages, another shard of the build publishes them.
+        """
+        digest = self.publisher.manifest.input_hash(src)
+        if digest not in self.sizes:
+            with Image.open(src) as image:
+                width, height = image.size
+                if image.getexif().get(ORIENTATION_TAG) in TRANSPOSED_ORIENTATIONS:
+                    width, height = height, width
+                self.sizes[digest] = (width, height, "A" in image.getbands() or "transparency" in image.info)
+        width, height, has_alpha = self.sizes[digest]
+        extension, image_format = self.variant_format(has_alpha)
+
+        variants = []
+        for variant_width in self.widths:
+            if extension is None or variant_width >= width:
+                continue
+            stem, source_extension = os.path.splitext(os.path.basename(rel_path))
+            name = f"{stem}-{source_extension[1:]}-{variant_width}w.{extension}"
+            variants.append((name, variant_width))
+            if not publish:
+                continue
+            cached = os.path.join(self.cache_dir, f"{digest}-{variant_width}-{IMAGES_VERSION}.{extension}")
+            if not os.path.exists(cached):
+                self.encode(src, cached, variant_width, image_format)
+            self.publisher.publish(cached, os.path.join(html_dir, os.path.dirname(rel_path), name))
+        self.info[os.path.normpath(rel_path)] = (src, width, height, variants)
+
+    def encode(self, src, cached, width, image_format):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with Image.open(src) as image:
+            # phone photos are stored rotated, with the orientation in their exif data
+            image = ImageOps.exif_transpose(image)
+            height = round(image.height * width / image.width)
+            if image_format == "JPEG" and image.mode != "RGB":
+                image = image.convert("RGB")
+            resized = image.resize((width, height), Image.LANCZOS)
+            tmp = cached + ".tmp"
+            if image_format == "WEBP":
+                resized.save(tmp, image_format, quality=80, method=6)
+            else:
+                resized.save(tmp, image_format, quality=82, optimize=True, progressive=True)
+        os.replace(tmp, cached)
+
+    def attributes(self, rel_path, src, sizes=None):
+        """srcset, sizes, width, height and lazy loading attributes of an image published at rel_path"""
+        source, width, height, variants = self.info[os.path.normpath(rel_path)]
+        attributes = f' width="{width}" height="{height}" loading="lazy" decoding="async"'
+        if variants:
+            base = src.rsplit("/", 1)[0] + "/" if "/" in src else ""
+            srcset = ", ".join([f"{base}{name} {w}w" for name, w in variants] + [f"{src} {width}w"])
+            attributes = f' srcset="{srcset}"' + (f' sizes="{sizes}"' if sizes else "") + attributes
+        return attributes
+
+    def rewrite(self, html, base_dir, sizes, sources=None):
+        """Add the responsive attributes to the <img> of a page.
+
+        base_dir is the directory of the page relative to the html dir, the
+        source of each image found is appended to sources.
+        """
+        def add_attributes(match):
+            tag, end = match.groups()
+            src = SRC_PATTERN.search(tag)
+            if not src or re.search(r'\s(?:srcset|loading)=', tag, re.IGNORECASE):
+                return match.group(0)
+            rel_path = resolve(base_dir, src.group(1))
+            if rel_path not in self.info:
+                return match.group(0)
+            if sources is not None:
+                sources.append(self.info[rel_path][0])
+            # keep the sizes chosen in the page
+            tag_sizes = None if re.search(r'\ssizes=', tag, re.IGNORECASE) else sizes
+            return tag + self.attributes(rel_path, src.group(1), tag_sizes) + end
+        return IMG_PATTERN.sub(add_attributes, html)
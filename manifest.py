@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+
+MANIFEST_VERSION = 1
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_text(text):
+    return hash_bytes(text.encode("utf-8"))
+
+def hash_file(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class BuildManifest:
+    """Record of the input hashes and of the outputs produced by a build.
+
+    Each output is stored with the list of inputs it depends on and a key
+    derived from their hashes, so the next build can skip outputs whose
+    key did not change and delete the ones that are no longer produced.
+    """
+    def __init__(self, path, html_dir, incremental=True):
+        self.path = path
+        self.html_dir = html_dir
+        self.incremental = incremental
+        self.previous = {"inputs": {}, "outputs": {}}
+        self.inputs = {}
+        self.outputs = {}
+        self.nb_skipped = 0
+        self.nb_built = 0
+        # outputs generated again by this build
+        self.built = []
+        # a full build also removes the outputs of the previous build it does not produce
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        # a manifest written for another output dir or format is useless
+        if data.get("version") != MANIFEST_VERSION or data.get("html_dir") != self.html_dir:
+            return
+        self.previous = data
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = {
+            "version": MANIFEST_VERSION,
+            "html_dir": self.html_dir,
+            "inputs": self.inputs,
+            "outputs": self.outputs,
+        }
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def start(self, changed=None):
+        """Begin a new build.
+
+        When the same manifest is used for several builds (watch mode),
+        changed is the set of inputs modified since the previous one: the
+        hashes of the other inputs are kept instead of being computed again.
+        """
+        if self.outputs:
+            self.previous = {"inputs": self.inputs, "outputs": self.outputs}
+        self.outputs = {}
+        if changed is None:
+            self.inputs = {}
+        else:
+            self.inputs = {name: digest for name, digest in self.inputs.items() if name not in changed}
+        self.nb_skipped = 0
+        self.nb_built = 0
+        self.built = []
+
+    def keep(self, output):
+        """Carry an output of the previous build over without checking it"""
+        self.outputs[output] = self.previous["outputs"][output]
+
+    def input_hash(self, path):
+        """Hash of an input file, computed once per build"""
+        if path not in self.inputs:
+            self.inputs[path] = hash_file(path)
+        return self.inputs[path]
+
+    def set_input(self, name, digest):
+        """Register an input that is not a file, like the configuration"""
+        self.inputs[name] = digest
+
+    def input_changed(self, path):
+        return self.previous["inputs"].get(path) != self.input_hash(path)
+
+    def check(self, output, inputs, context=""):
+        """Record the dependencies of an output and tell if it is up to date.
+
+        inputs is a list of file paths (or names given to set_input) and
+        context any extra string the output depends on, such as links to
+        other articles.
+        """
+        h = hashlib.sha256()
+        for name in inputs:
+            digest = self.inputs[name] if name in self.inputs else self.input_hash(name)
+            h.update(f"{name}\0{digest}\0".encode("utf-8"))
+        h.update(context.encode("utf-8"))
+        key = h.hexdigest()
+        self.outputs[output] = {"key": key, "inputs": list(inputs)}
+
+        previous = self.previous["outputs"].get(output)
+        if self.incremental and previous and previous["key"] == key and os.path.exists(output):
+            self.nb_skipped += 1
+            return True
+        self.nb_built += 1
+        self.built.append(output)
+        return False
+
+    def outputs_of(self, path):
+        """Outputs that depended on an input during the last build"""
+        return [output for output, entry in self.previous["outputs"].items() if path in entry["inputs"]]
+
+    def removed_outputs(self):
+        """Outputs of the previous build that this build did not produce"""
+        return sorted(set(self.previous["outputs"]) - set(self.outputs))
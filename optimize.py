@@ -0,0 +1,336 @@
+import hashlib
+import os
+import re
+
+# bump when the minified or critical css changes for the same inputs
+OPTIMIZE_VERSION = 3
+
+# comments are dropped, strings are kept as they are
+CSS_COMMENT_OR_STRING = re.compile(r'/\*.*?\*/|"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'', re.DOTALL)
+CSS_STRING = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')')
+# spaces that can go around these characters, ":" only loses the space after it as "a :hover" is not "a:hover"
+CSS_SPACES = re.compile(r"\s*([{};,>])\s*|(:)\s+")
+# space before the ":" of a declaration, followed by the end of its block
+CSS_DECLARATION_SPACE = re.compile(r"\s+:(?=[^{}]*\})")
+
+# names of the tags and values of the class and id attributes of a page
+TAG_PATTERN = re.compile(r"<([a-zA-Z][a-zA-Z0-9-]*)")
+CLASS_ID_PATTERN = re.compile(r'\s(class|id)=["\']([^"\']*)["\']')
+# what a selector needs from the page: tag names, .classes and #ids
+SIMPLE_SELECTOR = re.compile(r"([.#]?)(-?[_a-zA-Z][\w-]*)")
+SELECTOR_ARGUMENTS = re.compile(r"\([^()]*\)")
+SELECTOR_ATTRIBUTES = re.compile(r"\[[^\]]*\]|::?[\w-]+")
+# first top-level element of a rendered body, a void element or a text
+FIRST_BLOCK_PATTERN = re.compile(r"\s*(<([a-zA-Z][a-zA-Z0-9-]*)[^>]*>.*?</\2\s*>|<[^>]*>|[^<]+)", re.DOTALL)
+
+def minify_css(css):
+    """css without comments and with the spaces that do not change its meaning removed"""
+    css = CSS_COMMENT_OR_STRING.sub(lambda m: m.group(0) if m.group(0)[0] in "\"'" else "", css)
+    parts = CSS_STRING.split(css)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"\s+", " ", parts[i])
+        part = CSS_SPACES.sub(lambda m: m.group(1) or m.group(2), part)
+        parts[i] = CSS_DECLARATION_SPACE.sub(":", part).replace(";}", "}")
+    return "".join(parts).strip()
+
+# a "/" after these characters or keywords starts a regular expression, not a division
+JS_REGEX_PREFIX = set("(,=:[!&|?{};+-*%<>~^")
+JS_REGEX_KEYWORDS = {"return", "typeof", "case", "do", "else", "in", "of", "new", "delete", "void", "throw", "instanceof", "yield", "await"}
+
+def js_regex_allowed(code):
+    """Whether a "/" following the code already read starts a regular expression"""
+    code = code.rstrip()
+    if not code:
+        return True
+    if code[-1] in JS_REGEX_PREFIX:
+        return True
+    word = re.search(r"[\w$]+$", code)
+    return word is not None and word.group(0) in JS_REGEX_KEYWORDS
+
+def minify_js(js):
+    """js without indentation, blank lines and comments.
+
+    Strings, template literals and regular expressions are read as such, so
+    nothing inside them is changed. The line breaks of the code are kept, so
+    automatic semicolon insertion works as before. When the js cannot be
+    read this way (a string or regular expression not closed on its line,
+    a comment or template literal never closed), it is returned unchanged.
+    """
+    out = []
+    # one code line per item, the line breaks inside template literals are part of their line
+    lines = []
+    # open template literals: "`" while reading the literal, None while reading
+    # its ${...}, followed by the depth of the braces of that expression
+    templates = []
+    i, n = 0, len(js)
+    while i < n:
+        char = js[i]
+        if templates and templates[-1] == "`":
+            # inside a template literal
+            if char == "\\":
+                out.append(js[i:i + 2])
+                i += 2
+                continue
+            out.append(char)
+            if char == "`":
+                templates.pop()
+            elif js.startswith("${", i):
+                out.append("{")
+                templates[-1] = None
+                templates.append(0)
+                i += 1
+            i += 1
+            continue
+        if char == "\n":
+            lines.append("".join(out))
+            out = []
+        elif js.startswith("//", i):
+            end = js.find("\n", i)
+            i = n if end < 0 else end
+            continue
+        elif js.startswith("/*", i):
+            end = js.find("*/", i + 2)
+            if end < 0:
+                return js
+            if "\n" in js[i:end]:
+                # a comment over several lines still ends the line of code before it
+                lines.append("".join(out))
+                out = []
+            else:
+                out.append(" ")
+            i = end + 2
+            continue
+        elif char in "\"'":
+            end = i + 1
+            while end < n and js[end] != char:
+                if js[end] == "\n":
+                    return js
+                end += 2 if js[end] == "\\" else 1
+            if end >= n:
+                return js
+            out.append(js[i:end + 1])
+            i = end + 1
+            continue
+        elif char == "/" and js_regex_allowed("".join(out)):
+            end = i + 1
+            in_class = False
+            while end < n and (js[end] != "/" or in_class):
+                if js[end] == "\n":
+                    return js
+                if js[end] == "\\":
+                    end += 1
+                elif js[end] == "[":
+                    in_class = True
+                elif js[end] == "]":
+                    in_class = False
+                end += 1
+            if end >= n:
+                return js
+            out.append(js[i:end + 1])
+            i = end + 1
+            continue
+        elif char == "`":
+            templates.append("`")
+            out.append(char)
+        elif templates and char == "{":
+            templates[-1] += 1
+            out.append(char)
+        elif templates and char == "}":
+            out.append(char)
+            if templates[-1] == 0:
+                # back in the template literal around the expression
+                templates.pop()
+                templates[-1] = "`"
+            else:
+                templates[-1] -= 1
+        else:
+            out.append(char)
+        i += 1
+    if templates:
+        return js
+    lines.append("".join(out))
+    return "\n".join(line.strip() for line in lines if line.strip())
+
+MINIFIERS = {".css": minify_css, ".js": minify_js}
+
+def page_tokens(markup):
+    """Tag names, .classes and #ids of a page or template"""
+    tokens = {"html", "body"}
+    tokens.update(tag.lower() for tag in TAG_PATTERN.findall(markup))
+    for attribute, value in CLASS_ID_PATTERN.findall(markup):
+        prefix = "." if attribute == "class" else "#"
+        tokens.update(prefix + name for name in value.split())
+    return tokens
+
+def first_block(html):
+    """First block of a rendered body, the part of it on the first screen"""
+    match = FIRST_BLOCK_PATTERN.match(html)
+    return match.group(1) if match else ""
+
+def selector_used(selector, tokens):
+    """Whether every tag, class and id a selector needs is in the page, pseudo-classes and attributes are ignored"""
+    while SELECTOR_ARGUMENTS.search(selector):
+        selector = SELECTOR_ARGUMENTS.sub("", selector)
+    selector = SELECTOR_ATTRIBUTES.sub("", selector)
+    return all((prefix + name if prefix else name.lower()) in tokens for prefix, name in SIMPLE_SELECTOR.findall(selector))
+
+def css_blocks(css):
+    """Top-level (prelude, body) pairs of a minified stylesheet, body is None for statements like @import"""
+    blocks = []
+    depth = 0
+    start = body_start = 0
+    prelude = ""
+    quote = None
+    for i, char in enumerate(css):
+        if quote:
+            if char == quote and css[i - 1] != "\\":
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "{":
+            if depth == 0:
+                prelude = css[start:i].strip()
+                body_start = i + 1
+            depth += 1
+        elif char == "}":
+            depth -= 1
+            if depth == 0:
+                blocks.append((prelude, css[body_start:i]))
+                start = i + 1
+        elif char == ";" and depth == 0:
+            blocks.append((css[start:i + 1].strip(), None))
+            start = i + 1
+    return blocks
+
+def stylesheet_tokens(css):
+    """Tag names, .classes and #ids the selectors of a minified stylesheet refer to"""
+    tokens = set()
+    for prelude, body in css_blocks(css):
+        if body is None or prelude.startswith("@font-face"):
+            continue
+        if prelude.startswith(("@media", "@supports")):
+            tokens |= stylesheet_tokens(body)
+        elif not prelude.startswith("@"):
+            selectors = SELECTOR_ATTRIBUTES.sub("", SELECTOR_ARGUMENTS.sub("", prelude))
+            tokens.update(prefix + name if prefix else name.lower() for prefix, name in SIMPLE_SELECTOR.findall(selectors))
+    return tokens
+
+def critical_rules(css, tokens):
+    """Rules of a minified stylesheet whose selectors match the tokens of a page, in their order"""
+    rules = []
+    for prelude, body in css_blocks(css):
+        if body is None:
+            # @import and @charset stay in the stylesheet
+            continue
+        if prelude.startswith(("@media", "@supports")):
+            inner = critical_rules(body, tokens)
+            if inner:
+                rules.append(f"{prelude}{{{inner}}}")
+        elif prelude.startswith("@font-face"):
+            rules.append(f"{prelude}{{{body}}}")
+        elif prelude.startswith("@"):
+            # keyframes and the like come with the stylesheet
+            continue
+        elif any(selector_used(selector, tokens) for selector in prelude.split(",")):
+            rules.append(f"{prelude}{{{body}}}")
+    return "".join(rules)
+
+class AssetOptimizer:
+    """Minified css and js files of assets/ and critical css of the layouts.
+
+    The minified copy of a file is written once in the cache directory,
+    named by the hash of the source and OPTIMIZE_VERSION, and published in
+    its place (also under its hashed name). The critical css of a layout is
+    the part of the minified stylesheet whose selectors match the markup of
+    the layout above the footer and the content of the page: it is inlined in
+    the head of the pages and the stylesheet is loaded without blocking the
+    first render. It is cached by the hash of the stylesheet and of the
+    tokens of the markup the stylesheet refers to, shared by the pages with
+    the same kind of content.
+    """
+    def __init__(self, cache_dir, manifest, enabled=True):
+        self.cache_dir = os.path.join(cache_dir, "assets")
+        self.manifest = manifest
+        self.enabled = enabled
+        # source -> minified copy, for this build
+        self.minified = {}
+        # cache key -> critical css, for this build
+        self.critical_css = {}
+        # minified stylesheet -> tokens its selectors refer to
+        self.css_tokens = {}
+        # template -> (largest critical css size, stylesheet size), for the report
+        self.critical_sizes = {}
+
+    def start(self, css_src):
+        """Forget the files of the previous build, pages are checked against the "critical_css" input"""
+        self.minified = {}
+        self.critical_css = {}
+        self.css_tokens = {}
+        self.critical_sizes = {}
+        digest = f"{OPTIMIZE_VERSION}\0{self.manifest.input_hash(css_src)}" if self.enabled and os.path.isfile(css_src) else ""
+        self.manifest.set_input("critical_css", hashlib.sha256(digest.encode("utf-8")).hexdigest())
+
+    def cached(self, key, extension, make):
+        """Path of the cache file of key, written by make() when it does not exist"""
+        path = os.path.join(self.cache_dir, f"{key}{extension}")
+        if not os.path.exists(path):
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(make())
+            os.replace(tmp_path, path)
+        return path
+
+    def source(self, src):
+        """File to publish for src: its minified copy for the css and js files"""
+        extension = os.path.splitext(src)[1]
+        if not self.enabled or extension not in MINIFIERS:
+            return src
+        if src not in self.minified:
+            key = hashlib.sha256(f"{OPTIMIZE_VERSION}\0{self.manifest.input_hash(src)}".encode("utf-8")).hexdigest()
+            def make():
+                with open(src, "r", encoding="utf-8") as f:
+                    return MINIFIERS[extension](f.read())
+            self.minified[src] = self.cached(key, extension, make)
+        return self.minified[src]
+
+    def critical(self, css_src, markup, template_name=None):
+        """Critical css of a stylesheet for the markup of a page"""
+        css_path = self.source(css_src)
+        if css_path not in self.css_tokens:
+            with open(css_path, "r", encoding="utf-8") as f:
+                self.css_tokens[css_path] = stylesheet_tokens(f.read())
+        # the tokens the stylesheet does not refer to do not change its critical css
+        tokens = sorted(page_tokens(markup) & self.css_tokens[css_path])
+        key = hashlib.sha256(f"{OPTIMIZE_VERSION}\0{self.manifest.input_hash(css_path)}\0{' '.join(tokens)}".encode("utf-8")).hexdigest()
+        if key not in self.critical_css:
+            def make():
+                with open(css_path, "r", encoding="utf-8") as f:
+                    return critical_rules(f.read(), set(tokens))
+            path = self.cached(f"critical-{key}", ".css", make)
+            with open(path, "r", encoding="utf-8") as f:
+                self.critical_css[key] = f.read()
+        if template_name:
+            size = len(self.critical_css[key].encode("utf-8"))
+            if size > self.critical_sizes.get(template_name, (0, 0))[0]:
+                # the stylesheet actually served, minified
+                self.critical_sizes[template_name] = (size, os.path.getsize(css_path))
+        return self.critical_css[key]
+
+    def inline(self, html, css_url, critical_css):
+        """Put the critical css in the head of a page and load its stylesheet without blocking"""
+        link = f'<link rel="stylesheet" href="{css_url}">'
+        if not critical_css or link not in html:
+            return html
+        preload = f'<link rel="preload" href="{css_url}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">'
+        return html.replace(link, f"<style>{critical_css}</style>\n    {preload}\n    <noscript>{link}</noscript>", 1)
+
+    def stats(self):
+        lines = []
+        if self.minified:
+            size = sum(os.path.getsize(src) for src in self.minified)
+            minified_size = sum(os.path.getsize(path) for path in self.minified.values())
+            lines.append(f"minified assets: {len(self.minified)} files, {size} -> {minified_size} bytes ({size - minified_size} bytes saved)")
+        for template_name, (critical_size, css_size) in sorted(self.critical_sizes.items()):
+            lines.append(f"critical css of {template_name}: up to {critical_size} bytes inlined for the first screen, instead of {css_size} bytes of blocking stylesheet")
+        return "\n".join(lines)
@@ -0,0 +1,131 @@
+import hashlib
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from manifest import hash_file
+
+# threads comparing the generated files with the ones on disk, file I/O releases the GIL
+OUTPUT_THREADS = 4
+# bytes written to temporary files but not compared yet, bounds the disk and I/O backlog
+OUTPUT_MAX_PENDING_BYTES = 64 << 20
+
+def replace_if_changed(tmp_path, path, digest, size):
+    """Move a temporary file over path unless path already has its content, return whether it was written"""
+    try:
+        if os.path.isfile(path) and os.path.getsize(path) == size and hash_file(path) == digest:
+            os.remove(tmp_path)
+            return False
+        # also replaces a link to a source file instead of writing through it
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+class OutputWriter:
+    """Write the generated files of a build, only when their content changed.
+
+    The parts of a page are encoded and streamed by the caller to a
+    temporary file next to the output while they are hashed, so a page is
+    never held in memory as a whole. A thread then compares the hash with
+    the one of the file on disk: an unchanged file is kept, with its mtime
+    (and ETag), otherwise the temporary file is renamed over it, so a
+    reader never sees a half-written page. Directories are created once
+    per build. When more than max_pending_bytes wait to be compared, the
+    caller waits for the oldest ones. flush() waits for every write and
+    raises their errors.
+
+    A copy sent to another process starts its own threads.
+    """
+    def __init__(self, threads=OUTPUT_THREADS, max_pending_bytes=OUTPUT_MAX_PENDING_BYTES):
+        self.threads = threads
+        self.max_pending_bytes = max_pending_bytes
+        self.pool = None
+        self.pool_pid = None
+        # (future, size, temporary file) of the files not compared yet
+        self.pending = []
+        self.pending_bytes = 0
+        self.tmp_ids = itertools.count()
+        self.start()
+
+    def start(self):
+        # directories created or seen during this build
+        self.dirs = set()
+        self.nb_written = 0
+        self.nb_unchanged = 0
+
+    def get_pool(self):
+        # the threads of a pool do not survive a fork
+        if self.pool is None or self.pool_pid != os.getpid():
+            self.pool = ThreadPoolExecutor(self.threads, thread_name_prefix="output")
+            self.pool_pid = os.getpid()
+            self.pending = []
+            self.pending_bytes = 0
+        return self.pool
+
+    def makedirs(self, directory):
+        if directory not in self.dirs:
+            os.makedirs(directory, exist_ok=True)
+            self.dirs.add(directory)
+
+    def write(self, path, parts):
+        """Write a file given as an iterable of strings, return its size"""
+        return self.write_chunks(path, (part.encode("utf-8") for part in parts))
+
+    def write_chunks(self, path, chunks):
+        """Write a file given as an iterable of bytes, return its size"""
+        pool = self.get_pool()
+        self.makedirs(os.path.dirname(path))
+        tmp_path = f"{path}.{os.getpid()}.{next(self.tmp_ids)}.tmp"
+        h = hashlib.sha256()
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    h.update(chunk)
+                    size += len(chunk)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.pending.append((pool.submit(replace_if_changed, tmp_path, path, h.hexdigest(), size), size, tmp_path))
+        self.pending_bytes += size
+        while self.pending_bytes > self.max_pending_bytes:
+            future, pending_size, pending_tmp_path = self.pending.pop(0)
+            self.pending_bytes -= pending_size
+            self.count(future.result())
+        return size
+
+    def count(self, written):
+        if written:
+            self.nb_written += 1
+        else:
+            self.nb_unchanged += 1
+
+    def flush(self):
+        """Wait for the queued writes, before the end of a build or a fork"""
+        pending, self.pending = self.pending, []
+        self.pending_bytes = 0
+        for i, (future, size, tmp_path) in enumerate(pending):
+            try:
+                self.count(future.result())
+            except BaseException:
+                for other, other_size, other_tmp_path in pending[i + 1:]:
+                    if other.cancel() and os.path.exists(other_tmp_path):
+                        os.remove(other_tmp_path)
+                raise
+
+    def stats(self):
+        return f"output files: {self.nb_written} written, {self.nb_unchanged} unchanged"
+
+    def __getstate__(self):
+        # threads and futures cannot be pickled
+        state = self.__dict__.copy()
+        state.update(pool=None, pool_pid=None, pending=[], pending_bytes=0, tmp_ids=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tmp_ids = itertools.count()
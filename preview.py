@@ -0,0 +1,241 @@
+import asyncio
+import mimetypes
+import os
+import posixpath
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote, urlsplit
+from watch import Watcher
+
+# rendered pages kept in memory
+PREVIEW_CACHE_PAGES = 256
+# seconds between two polls of the markdown directory
+POLL_INTERVAL = 1.0
+
+class PreviewServer:
+    """Serve a website from memory, rendering each page when it is requested.
+
+    Only the front matter of the articles is loaded at startup. Article,
+    index and tag pages are rendered by the render methods of Website on
+    their first request and kept in an LRU cache with the mtimes of the
+    files they were rendered from: a page is rendered again when one of
+    them changed. The markdown directory is polled to load added, removed
+    or edited articles; when the title, date, tags or language of an
+    article change, other pages may list it and the cache is emptied.
+    Files are served from assets/, static/ and the article directories.
+
+    The Website object is only used from a single thread, the event loop
+    just reads requests and writes responses.
+    """
+    def __init__(self, website, cache_pages=PREVIEW_CACHE_PAGES):
+        self.website = website
+        self.cache_pages = cache_pages
+        self.executor = ThreadPoolExecutor(1)
+        self.watcher = None
+        # output path -> page to render
+        self.pages = {}
+        # output path -> (body, {source: mtime})
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        """Load the front matter of the articles"""
+        start = time.perf_counter()
+        www = self.website
+        self.watcher = Watcher([www.config.md_dir], POLL_INTERVAL)
+        www.manifest.start()
+        www.manifest.set_input("settings", www.config.fingerprint())
+        www.assets.start()
+        www.init_articles()
+        self.index_pages()
+        self.commit()
+        print(f"{len(www.articles)} articles loaded in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    def index_pages(self):
+        """Pages of the website by output path"""
+        www = self.website
+        pages = {os.path.join(www.config.html_dir, "index.html"): ("root",)}
+        for language in www.articles_by_language:
+            for page in range(www.index_page_count(language)):
+                pages[www.index_page_path(language, page)] = ("index", language, page)
+            for tag in www.tag_index.tags(language):
+                pages[www.tag_page_path(language, tag)] = ("tag", language, tag)
+        for article in www.articles:
+            pages[article.path] = ("article", article)
+        self.pages = pages
+
+    def summary(self, md_file):
+        """What the pages of other articles show of an article"""
+        article = self.website.loaded_articles.get(md_file)
+        return article and (article.title, article.date, tuple(article.tags), article.language)
+
+    def update(self, changed):
+        """Apply the changes of the markdown directory to the articles"""
+        md_files = {path for path in changed if self.website.is_markdown_file(path)}
+        if not md_files:
+            return
+        before = {md_file: self.summary(md_file) for md_file in md_files}
+        self.website.init_articles(md_files)
+        self.index_pages()
+        if any(self.summary(md_file) != summary for md_file, summary in before.items()):
+            self.cache.clear()
+        print(f"{len(md_files)} articles reloaded")
+
+    def poll(self):
+        self.update(self.watcher.poll())
+
+    def sources(self, key):
+        """Files a page is rendered from, besides the articles model"""
+        www = self.website
+        if key[0] == "article":
+            article = key[1]
+            return [article.md_file_path, www.template_path(www.article_template_name(article))]
+        if key[0] == "index":
+            language, page = key[1:]
+            return ([www.template_path(www.index_template_name(language)), www.template_path(www.embedded_article_template_name())]
+                    + [article.md_file_path for article in www.index_page_articles(language, page)])
+        if key[0] == "tag":
+            return [www.template_path(www.tag_template_name(key[1]))]
+        return []
+
+    def render(self, key):
+        www = self.website
+        if key[0] == "article":
+            return www.render_html_article(key[1])
+        if key[0] == "index":
+            return "".join(www.render_index_page(*key[1:]))
+        if key[0] == "tag":
+            return www.render_tag_page(*key[1:])
+        return www.render_root_index()
+
+    @staticmethod
+    def mtimes(paths):
+        mtimes = {}
+        for path in paths:
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                mtimes[path] = None
+        return mtimes
+
+    def page(self, output):
+        """Html of a page, None if there is no such page"""
+        entry = self.cache.get(output)
+        if entry is not None:
+            body, mtimes = entry
+            if self.mtimes(mtimes) == mtimes:
+                self.cache.move_to_end(output)
+                self.hits += 1
+                return body
+            # a source changed before the next poll noticed it
+            self.poll()
+        key = self.pages.get(output)
+        if key is None:
+            return None
+        self.misses += 1
+        # mtimes are read first so that a change made while rendering is not missed
+        mtimes = self.mtimes(self.sources(key))
+        body = self.render(key).encode("utf-8")
+        self.cache[output] = (body, mtimes)
+        self.cache.move_to_end(output)
+        while len(self.cache) > self.cache_pages:
+            self.cache.popitem(last=False)
+        self.commit()
+        return body
+
+    def commit(self):
+        """Keep the articles and code blocks rendered so far for the next builds"""
+        for cache in (self.website.cache, self.website.highlights, self.website.front_matters):
+            if cache:
+                cache.commit()
+
+    def close(self):
+        for cache in (self.website.cache, self.website.highlights, self.website.front_matters):
+            if cache:
+                cache.close()
+
+    def file(self, rel_path):
+        """Path of a file of assets/, static/ or an article directory, None if there is none"""
+        md_dir = self.website.config.md_dir
+        candidates = [rel_path if rel_path.startswith("assets/") else None, os.path.join("static", rel_path)]
+        # markdown sources are not published
+        if not rel_path.endswith(".md"):
+            candidates.append(os.path.join(md_dir, rel_path))
+        for path in candidates:
+            if path and os.path.isfile(path):
+                return path
+        return None
+
+    def respond(self, target):
+        """Status, content type and body of the response to a request target"""
+        url_path = unquote(urlsplit(target).path)
+        # normpath drops the .. that would lead out of the served directories
+        rel_path = posixpath.normpath(url_path).lstrip("/")
+        if url_path.endswith("/"):
+            rel_path = posixpath.join(rel_path, "index.html")
+        output = os.path.join(self.website.config.html_dir, rel_path)
+        body = self.page(output)
+        if body is not None:
+            return HTTPStatus.OK, "text/html; charset=utf-8", body, {}
+        if os.path.join(output, "index.html") in self.pages:
+            # relative links of directory pages need the trailing slash
+            return HTTPStatus.MOVED_PERMANENTLY, "text/plain", b"", {"Location": url_path + "/"}
+        path = self.file(rel_path)
+        if path is None:
+            return HTTPStatus.NOT_FOUND, "text/plain; charset=utf-8", f"{url_path} not found\n".encode("utf-8"), {}
+        with open(path, "rb") as f:
+            body = f.read()
+        return HTTPStatus.OK, mimetypes.guess_type(path)[0] or "application/octet-stream", body, {}
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            # headers are not used
+            while (await reader.readline()).strip():
+                pass
+            start = time.perf_counter()
+            if len(request_line) != 3:
+                status, content_type, body, headers = HTTPStatus.BAD_REQUEST, "text/plain", b"", {}
+            elif request_line[0] not in ("GET", "HEAD"):
+                status, content_type, body, headers = HTTPStatus.METHOD_NOT_ALLOWED, "text/plain", b"", {"Allow": "GET, HEAD"}
+            else:
+                status, content_type, body, headers = await asyncio.get_running_loop().run_in_executor(self.executor, self.respond, request_line[1])
+            headers = dict(headers, **{"Content-Type": content_type, "Content-Length": str(len(body)), "Cache-Control": "no-cache", "Connection": "close"})
+            writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n".encode("latin-1"))
+            writer.write("".join(f"{name}: {value}\r\n" for name, value in headers.items()).encode("latin-1") + b"\r\n")
+            if request_line and request_line[0] != "HEAD":
+                writer.write(body)
+            await writer.drain()
+            if len(request_line) == 3:
+                print(f"{request_line[0]} {request_line[1]} {status.value} {(time.perf_counter() - start) * 1000:.1f} ms")
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def poll_sources(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            await loop.run_in_executor(self.executor, self.poll)
+
+    async def serve(self, host, port):
+        loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}/, press Ctrl+C to stop")
+        await loop.run_in_executor(self.executor, self.load)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.poll_sources())
+
+    def run(self, host="127.0.0.1", port=8000):
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.submit(self.close).result()
+            self.executor.shutdown()
+            print(f"preview cache: {self.hits} hits, {self.misses} misses")
@@ -0,0 +1,136 @@
+import fcntl
+import json
+import os
+import shutil
+from manifest import hash_text
+
+# files of assets/ also published under a content-hashed name, which pages reference
+FINGERPRINTED_EXTENSIONS = (".css", ".js")
+FINGERPRINT_LENGTH = 10
+
+# ioctl asking the filesystem (btrfs, xfs...) to share the blocks of two files
+FICLONE = 0x40049409
+
+def reflink(src, dst):
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+
+class AssetPublisher:
+    """Publish source files (images, css, static pages...) into the html dir.
+
+    Files with the same content are stored once: the first copy is published
+    and the others are hardlinked to it. In "link" mode the first copy is
+    itself a hardlink (or a reflink) of the source when both are on the same
+    filesystem, so publishing costs no I/O. Later build stages must never
+    modify published files in place.
+    """
+    def __init__(self, manifest, link_mode="link"):
+        self.manifest = manifest
+        self.link_mode = link_mode
+        self.start()
+
+    def start(self):
+        # content hash -> first output with this content
+        self.published = {}
+        self.nb_linked = 0
+        self.nb_copied = 0
+        self.nb_deduplicated = 0
+
+    def publish(self, src, dst, origin=None):
+        """Publish src as dst, origin is the source file src was made from, like a minified copy"""
+        digest = self.manifest.input_hash(src)
+        first = self.published.setdefault(digest, dst)
+        if self.manifest.check(dst, [src] if origin in (None, src) else [origin, src]):
+            return
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if os.path.lexists(dst):
+            # never write through a link shared with the source or another output
+            os.remove(dst)
+        if first != dst and AssetPublisher.link(first, dst):
+            self.nb_deduplicated += 1
+        elif self.link_mode == "link" and AssetPublisher.link(src, dst):
+            self.nb_linked += 1
+        else:
+            shutil.copy2(src, dst)
+            self.nb_copied += 1
+
+    @staticmethod
+    def link(src, dst):
+        """Make dst share the content of src, return False when the filesystem cannot"""
+        try:
+            os.link(src, dst)
+            return True
+        except OSError:
+            pass
+        try:
+            reflink(src, dst)
+            shutil.copystat(src, dst)
+            return True
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+            return False
+
+    def stats(self):
+        return f"published files: {self.nb_linked} linked, {self.nb_copied} copied, {self.nb_deduplicated} deduplicated"
+
+class AssetFingerprints:
+    """Content-hashed names of the css and js files of assets/.
+
+    Each file is published under its own name and as name.<hash>.ext, for
+    example style.3f9a1c2b7e.css. Pages reference the hashed name, which
+    changes with the content, so the web server can let browsers cache it
+    for a year. assets/manifest.json maps the names to the hashed names.
+    The "assets" input of the manifest changes with any of them. With an
+    AssetOptimizer, the hash is the one of the minified copy, which is
+    what gets published.
+    """
+    def __init__(self, manifest, publisher, output, src_dir="assets", enabled=True, optimizer=None):
+        self.manifest = manifest
+        self.publisher = publisher
+        # writes assets/manifest.json, unchanged it keeps its mtime
+        self.output = output
+        self.src_dir = src_dir
+        self.enabled = enabled
+        self.optimizer = optimizer
+        self.names = {}
+
+    def published_file(self, src):
+        """File published for a source of src_dir"""
+        return self.optimizer.source(src) if self.optimizer else src
+
+    def start(self):
+        """Hash the files, before any page is checked against the "assets" input"""
+        self.names = {}
+        if self.enabled:
+            for root, dirs, files in os.walk(self.src_dir):
+                for file in sorted(files):
+                    if file.endswith(FINGERPRINTED_EXTENSIONS):
+                        name = os.path.relpath(os.path.join(root, file), self.src_dir).replace(os.sep, "/")
+                        base, extension = os.path.splitext(name)
+                        digest = self.manifest.input_hash(self.published_file(os.path.join(self.src_dir, name)))
+                        self.names[name] = f"{base}.{digest[:FINGERPRINT_LENGTH]}{extension}"
+        self.manifest.set_input("assets", hash_text(json.dumps(self.names, sort_keys=True)))
+
+    def publish(self, dst_dir):
+        """Publish the hashed copies and the manifest, return the number of bytes written"""
+        for name, hashed_name in self.names.items():
+            src = os.path.join(self.src_dir, name)
+            self.publisher.publish(self.published_file(src), os.path.join(dst_dir, hashed_name), src)
+        if not self.enabled:
+            return 0
+        path = os.path.join(dst_dir, "manifest.json")
+        if self.manifest.check(path, ["assets"]):
+            return 0
+        data = json.dumps(self.names, indent=1, sort_keys=True).encode("utf-8")
+        return self.output.write_chunks(path, [data])
+
+    def name(self, name):
+        """Published name of a file of assets/"""
+        return self.names.get(name, name)
+
+    def rewrite(self, html, assets_url):
+        """Make the references of a page to assets_url + name point to the hashed names"""
+        for name, hashed_name in self.names.items():
+            html = html.replace(f'"{assets_url}{name}"', f'"{assets_url}{hashed_name}"')
+        return html
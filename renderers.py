@@ -0,0 +1,175 @@
+import json
+import re
+import markdown,yaml,pygments
+from markdown.extensions import Extension
+from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension
+from markdown.treeprocessors import Treeprocessor
+
+try:
+    import markdown_it
+    from markdown_it import MarkdownIt
+except ImportError:
+    markdown_it = None
+
+MARKDOWN_EXTENSIONS = [
+    'fenced_code',
+    'codehilite',
+    'tables',
+    'markdown.extensions.nl2br'
+]
+
+# files next to the articles that their links and images point to
+ASSET_LINK_SUFFIXES = (".png", ".jpg", ".jpeg", ".svg", ".excalidraw", ".txt")
+ASSET_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".svg")
+# prefix of the rewritten asset urls in the rendered html, each page replaces it
+# with its relative path to the directory where the files of the article are published
+ASSET_DIR_MARKER = "\0asset_dir\0"
+# bump when the rewriting of the asset urls changes
+ASSET_LINKS_VERSION = 1
+
+def is_relative_url(url):
+    return not (url.startswith(("/", "#")) or re.match(r"^[a-zA-Z][a-zA-Z0-9+.-]*:", url))
+
+def asset_url(url, suffixes):
+    """url prefixed with ASSET_DIR_MARKER when it points to a file next to the article"""
+    if url and is_relative_url(url) and url.lower().endswith(suffixes):
+        return ASSET_DIR_MARKER + url
+    return url
+
+class AssetLinkTreeprocessor(Treeprocessor):
+    """Prefix the relative urls of the images and linked files with ASSET_DIR_MARKER"""
+    def run(self, root):
+        for element in root.iter():
+            if element.tag == "img":
+                attribute, suffixes = "src", ASSET_IMAGE_SUFFIXES
+            elif element.tag == "a":
+                attribute, suffixes = "href", ASSET_LINK_SUFFIXES
+            else:
+                continue
+            url = element.get(attribute)
+            if url:
+                element.set(attribute, asset_url(url, suffixes))
+
+class AssetLinkExtension(Extension):
+    def extendMarkdown(self, md):
+        # after the inline patterns, which create the links and images
+        md.treeprocessors.register(AssetLinkTreeprocessor(md), "asset_links", 5)
+
+class PythonMarkdownRenderer:
+    """Python-Markdown with MARKDOWN_EXTENSIONS.
+
+    The engines are built once per process and reset between documents,
+    instead of loading the extensions and compiling their patterns for
+    every article.
+    """
+    name = "python-markdown"
+
+    @staticmethod
+    def available():
+        return True
+
+    def __init__(self):
+        self.engine = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS + [AssetLinkExtension()])
+        # snippets are rendered without extensions
+        self.snippet_engine = markdown.Markdown()
+
+    def versions(self):
+        return {"markdown": markdown.__version__}
+
+    def render(self, text):
+        return self.engine.reset().convert(text)
+
+    def render_snippet(self, text):
+        return self.snippet_engine.reset().convert(text)
+
+def render_fence(renderer, tokens, idx, options, env):
+    """Fenced code block highlighted like the fenced_code and codehilite extensions do, through the highlight cache"""
+    token = tokens[idx]
+    info = token.info.strip().split(maxsplit=1)
+    config = CommonMarkRenderer.codehilite_config.copy()
+    highlighter = CodeHilite(token.content, lang=info[0] if info else None, style=config.pop("pygments_style", "default"), **config)
+    return highlighter.hilite(shebang=False) + "\n"
+
+def render_code_block(renderer, tokens, idx, options, env):
+    """Indented code block, highlighted by codehilite too, which reads a language from a shebang line"""
+    config = CommonMarkRenderer.codehilite_config.copy()
+    highlighter = CodeHilite(tokens[idx].content, style=config.pop("pygments_style", "default"), tab_length=4, **config)
+    return highlighter.hilite() + "\n"
+
+class CommonMarkRenderer:
+    """markdown-it-py, a CommonMark parser, when it is installed.
+
+    Tables and line breaks are enabled to match the tables and nl2br
+    extensions, fenced code is highlighted with the codehilite markup and
+    the asset urls are rewritten on the token stream.
+    """
+    name = "commonmark"
+    codehilite_config = CodeHiliteExtension().getConfigs()
+
+    @staticmethod
+    def available():
+        return markdown_it is not None
+
+    def __init__(self):
+        self.engine = MarkdownIt("commonmark", {"breaks": True}).enable("table")
+        self.engine.add_render_rule("fence", render_fence)
+        self.engine.add_render_rule("code_block", render_code_block)
+        self.snippet_engine = MarkdownIt("commonmark")
+
+    def versions(self):
+        return {"markdown-it-py": markdown_it.__version__}
+
+    def render(self, text):
+        env = {}
+        tokens = self.engine.parse(text, env)
+        for token in tokens:
+            for child in token.children or []:
+                if child.type == "image":
+                    child.attrSet("src", asset_url(child.attrGet("src"), ASSET_IMAGE_SUFFIXES))
+                elif child.type == "link_open":
+                    child.attrSet("href", asset_url(child.attrGet("href"), ASSET_LINK_SUFFIXES))
+        return self.engine.renderer.render(tokens, self.engine.options, env)
+
+    def render_snippet(self, text):
+        return self.snippet_engine.render(text)
+
+RENDERERS = {renderer.name: renderer for renderer in (PythonMarkdownRenderer, CommonMarkRenderer)}
+DEFAULT_RENDERER = PythonMarkdownRenderer.name
+
+# backend selected by use(), its engine is built on first use in each process
+renderer_name = DEFAULT_RENDERER
+engine = None
+
+def check_name(name):
+    if name not in RENDERERS:
+        raise ValueError(f"unknown markdown renderer {name}, expected one of {', '.join(RENDERERS)}")
+
+def available_renderer(name):
+    """name if its library is installed, else the default backend"""
+    check_name(name)
+    return name if RENDERERS[name].available() else DEFAULT_RENDERER
+
+def use(name):
+    """Select the backend used to render the articles in this process"""
+    global renderer_name, engine
+    check_name(name)
+    if name != renderer_name:
+        renderer_name = name
+        engine = None
+
+def get_renderer():
+    global engine
+    if engine is None:
+        engine = RENDERERS[renderer_name]()
+    return engine
+
+def parser_fingerprint():
+    """Configuration and library versions the parsed articles depend on"""
+    return json.dumps(dict({
+        "renderer": renderer_name,
+        "extensions": MARKDOWN_EXTENSIONS,
+        "asset_links": ASSET_LINKS_VERSION,
+        "markdown": markdown.__version__,
+        "yaml": yaml.__version__,
+        "pygments": pygments.__version__,
+    }, **get_renderer().versions()), sort_keys=True)
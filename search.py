@@ -0,0 +1,154 @@
+import json
+import os
+import re
+import unicodedata
+from manifest import hash_bytes
+
+# bump when the tokenizer or the format of the index changes
+SEARCH_VERSION = 1
+# terms are sharded by their first characters, the browser only fetches the shards of the query;
+# below SMALL_INDEX_TERMS terms, the first character is enough
+PREFIX_LENGTH = 2
+SMALL_INDEX_TERMS = 20000
+MIN_STEM_LENGTH = 3
+# a word in the title counts as much as 10 words of the body
+FIELD_WEIGHTS = {"title": 10, "tags": 5, "abstract": 3, "body": 1}
+
+# after accent folding, like the words they are compared with
+STOP_WORDS = {
+    "fr": """a ai aie aient aies ait alors as au aucun aussi autre aux avec avoir avons avez ayant c ca car ce ceci cela celle
+        celles celui ces cet cette ceux chaque ci comme comment d dans de des deja depuis donc dont du elle elles en encore
+        entre est et etaient etait etant ete etre eu eux fait faire fois font hors ici il ils j je jusqu l la le les leur
+        leurs lui m ma mais me meme mes moi mon n ne ni nos notre nous on ont ou par parce pas peu peut plus pour pourquoi
+        qu quand que quel quelle quelles quels qui s sa sans se sera ses si sien son sont sous sur t ta tandis te tes toi
+        ton tous tout toute toutes tres tu un une unes uns vers via voici voila vos votre vous y""".split(),
+    "en": """a about above after again against all am an and any are as at be because been before being below between
+        both but by can could did do does doing down during each few for from further had has have having he her here hers
+        herself him himself his how i if in into is it its itself just me more most my myself no nor not now of off on
+        once only or other our ours ourselves out over own same she should so some such than that the their theirs them
+        themselves then there these they this those through to too under until up very was we were what when where which
+        while who whom why will with would you your yours yourself yourselves""".split(),
+}
+
+# light stemmers: the first rule whose suffix matches, leaving at least
+# MIN_STEM_LENGTH characters, replaces the suffix
+STEM_RULES = {
+    "fr": [
+        ("issements", ""), ("issement", ""), ("atrices", ""), ("ateurs", ""), ("ations", ""), ("atrice", ""),
+        ("ateur", ""), ("ation", ""), ("ements", ""), ("ement", ""), ("ments", ""), ("ment", ""),
+        ("euses", ""), ("euse", ""), ("eux", ""), ("ites", ""), ("ite", ""), ("ives", ""), ("ive", ""),
+        ("ifs", ""), ("iques", ""), ("ique", ""), ("ismes", ""), ("isme", ""), ("istes", ""), ("iste", ""),
+        ("ables", ""), ("able", ""), ("ances", ""), ("ance", ""), ("ences", ""), ("ence", ""),
+        ("eaux", "eau"), ("aux", "al"), ("es", ""), ("s", ""), ("e", ""), ("x", ""),
+    ],
+    "en": [
+        ("ational", "ate"), ("ization", "ize"), ("fulness", "ful"), ("iveness", "ive"), ("ousness", "ous"),
+        ("ations", "ate"), ("ation", "ate"), ("sses", "ss"), ("ies", "y"), ("ied", "y"), ("ying", "y"),
+        ("ings", ""), ("ing", ""), ("edly", ""), ("ed", ""), ("ers", ""), ("er", ""), ("ly", ""),
+        ("ss", "ss"), ("es", ""), ("s", ""), ("e", ""),
+    ],
+}
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# parts of the markdown source that are not text: code blocks, html tags, urls of links and images
+MARKUP_PATTERN = re.compile(r"^(```|~~~).*?^\1|<[^>]+>|\]\([^)]*\)|https?://\S+", re.MULTILINE | re.DOTALL)
+
+def fold(text):
+    """Lower case without accents, the search widget does the same"""
+    text = text.lower().replace("œ", "oe").replace("æ", "ae")
+    return re.sub("[\u0300-\u036f]", "", unicodedata.normalize("NFD", text))
+
+def stem(word, rules):
+    for suffix, replacement in rules:
+        if word.endswith(suffix) and len(word) - len(suffix) >= MIN_STEM_LENGTH:
+            return word[:len(word) - len(suffix)] + replacement
+    return word
+
+def terms(text, language):
+    """Stemmed words of a text, without the stop words"""
+    stop_words = STOP_WORDS.get(language, ())
+    rules = STEM_RULES.get(language, [])
+    return [stem(word, rules) for word in WORD_PATTERN.findall(fold(text)) if len(word) > 1 and word not in stop_words]
+
+def article_terms(article):
+    """Score of each term of an article, weighted by the field it appears in"""
+    fields = {
+        "title": article.title,
+        "tags": " ".join(article.tags),
+        "abstract": article.abstract,
+        "body": MARKUP_PATTERN.sub(" ", article.md_content),
+    }
+    scores = {}
+    for field, text in fields.items():
+        for term in terms(str(text), article.language):
+            scores[term] = scores.get(term, 0) + FIELD_WEIGHTS[field]
+    return scores
+
+class SearchIndex:
+    """Inverted index of the articles of each language, for the search widget.
+
+    search/<lang>/meta.json holds the documents and the tokenizer rules, and
+    each search/<lang>/<prefix>.json shard maps the terms starting with
+    prefix to a flat list of (document id, score). Terms of an article are
+    cached by hash of its markdown file, shards are only written when their
+    content changed.
+    """
+    def __init__(self, manifest, output, cache=None):
+        self.manifest = manifest
+        self.output = output
+        self.cache = cache
+        # markdown file -> scores computed by the shards of a sharded build
+        self.known_scores = {}
+
+    def scores(self, article):
+        if article.md_file_path in self.known_scores:
+            return self.known_scores[article.md_file_path]
+        key = f"search-{SEARCH_VERSION}-{article.language}-{self.manifest.input_hash(article.md_file_path)}"
+        scores = self.cache.get(key) if self.cache else None
+        if scores is None:
+            scores = article_terms(article)
+            if self.cache:
+                self.cache.put(key, scores)
+        return scores
+
+    def write(self, html_dir, language, articles):
+        """Write the index of the articles of a language, sorted by date, return the number of files and bytes written"""
+        index_dir = os.path.join(html_dir, "search", language)
+        documents = []
+        postings = {}
+        for i, article in enumerate(articles):
+            url = os.path.relpath(os.path.dirname(article.path), html_dir).replace(os.sep, "/") + "/"
+            documents.append([url, article.title, article.date])
+            for term, score in self.scores(article).items():
+                postings.setdefault(term, []).extend((i, score))
+
+        prefix_length = 1 if len(postings) < SMALL_INDEX_TERMS else PREFIX_LENGTH
+        shards = {}
+        for term, term_postings in postings.items():
+            shards.setdefault(term[:prefix_length], {})[term] = term_postings
+
+        meta = {
+            "version": SEARCH_VERSION,
+            "prefix": prefix_length,
+            "min_stem": MIN_STEM_LENGTH,
+            "stop_words": sorted(STOP_WORDS.get(language, ())),
+            "rules": STEM_RULES.get(language, []),
+            "shards": sorted(shards),
+            "documents": documents,
+        }
+        files = {"meta.json": meta}
+        for prefix, shard in shards.items():
+            files[f"{prefix}.json"] = shard
+
+        nb_written = bytes_written = size = 0
+        for name, data in files.items():
+            data = json.dumps(data, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+            size += len(data)
+            path = os.path.join(index_dir, name)
+            if self.manifest.check(path, ["settings"], hash_bytes(data)):
+                continue
+            self.output.write_chunks(path, [data])
+            nb_written += 1
+            bytes_written += len(data)
+        print(f"search index ({language}): {len(documents)} documents, {len(postings)} terms, {len(shards)} shards, {size} bytes, {nb_written} files written")
+        return nb_written, bytes_written
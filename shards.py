@@ -0,0 +1,77 @@
+import argparse
+import hashlib
+import json
+import os
+
+# bump when the snapshot or the shard listings change
+SHARDS_VERSION = 1
+
+def shard_of(key, count):
+    """Shard of a unit of work, the same on every machine and for every build"""
+    return int(hashlib.sha256(key.encode("utf-8")).hexdigest()[:8], 16) % count
+
+def parse_shard(value):
+    """i/N of --shard, as (i, N)"""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/N, got {value}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"shard {index} does not exist among {count} shards")
+    return index, count
+
+def snapshot_path(shards_dir):
+    return os.path.join(shards_dir, "snapshot.json")
+
+def shard_dir(shards_dir, index, count):
+    """Directory of a shard: its pages in html/ and their listing in shard.json"""
+    return os.path.join(shards_dir, f"{index}-of-{count}")
+
+def listing_path(html_dir):
+    return os.path.join(os.path.dirname(html_dir), "shard.json")
+
+def write_json(path, data):
+    """Write data as json, atomically as several shards may read it"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, sort_keys=True, default=str)
+    os.replace(tmp_path, path)
+
+def read_json(path):
+    """Data and hash of a json file, None when it does not exist"""
+    try:
+        with open(path, "rb") as f:
+            content = f.read()
+    except FileNotFoundError:
+        return None, None
+    return json.loads(content), hashlib.sha256(content).hexdigest()
+
+def check_listings(listings, count, snapshot_digest, expected):
+    """Problems of the listings of the shards of a build, and the shard of each output.
+
+    listings is a list of (shard dir, listing or None), expected the
+    outputs every build must produce, relative to the html dir.
+    """
+    problems = []
+    owners = {}
+    for index, (directory, listing) in enumerate(listings):
+        if listing is None:
+            problems.append(f"shard {index}/{count}: no {os.path.join(directory, 'shard.json')}, the shard was not built")
+            continue
+        if listing.get("version") != SHARDS_VERSION or listing.get("count") != count or listing.get("shard") != index:
+            problems.append(f"shard {index}/{count}: {directory} was built as another shard")
+            continue
+        if listing.get("snapshot") != snapshot_digest:
+            problems.append(f"shard {index}/{count}: built from another snapshot")
+            continue
+        for output in listing["outputs"]:
+            if output in owners:
+                problems.append(f"{output}: produced by shards {owners[output]} and {index}")
+            elif not os.path.isfile(os.path.join(directory, "html", output)):
+                problems.append(f"{output}: listed by shard {index} but missing from {directory}")
+            else:
+                owners[output] = index
+    if not problems:
+        problems += [f"{output}: produced by no shard" for output in sorted(expected - set(owners))]
+    return problems, owners
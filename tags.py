@@ -0,0 +1,52 @@
+import re
+
+def normalize_tags(value):
+    """List of the tags of an article: stripped, without empty or repeated tags"""
+    if isinstance(value, str):
+        value = value.split(",")
+    tags = []
+    for tag in value or []:
+        # "machine  learning" and " machine learning" are the same tag
+        tag = re.sub(r"\s+", " ", str(tag)).strip()
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+class TagIndex:
+    """Inverted index of the tags, built in a single pass over the articles.
+
+    Articles are identified by their position in the list given to build,
+    sorted by date, so every list of ids is sorted by date too. Tags are
+    ordered by count, ties in order of first appearance.
+    """
+    def __init__(self):
+        self.build([])
+
+    def build(self, articles):
+        self.articles = articles
+        # language -> tag -> [article ids]
+        self.ids_by_language = {}
+        # tag -> [article ids], all languages
+        self.ids = {}
+        for i, article in enumerate(articles):
+            by_tag = self.ids_by_language.setdefault(article.language, {})
+            for tag in article.tags:
+                by_tag.setdefault(tag, []).append(i)
+                self.ids.setdefault(tag, []).append(i)
+        self.sorted_tags_by_language = {language: self.by_count(by_tag) for language, by_tag in self.ids_by_language.items()}
+        self.sorted_tags = self.by_count(self.ids)
+
+    @staticmethod
+    def by_count(ids):
+        return sorted(ids, key=lambda tag: len(ids[tag]), reverse=True)
+
+    def tags(self, language):
+        """Tags of a language, most used first"""
+        return self.sorted_tags_by_language.get(language, [])
+
+    def count(self, language, tag):
+        return len(self.ids_by_language.get(language, {}).get(tag, []))
+
+    def get_articles(self, language, tag):
+        """Articles of a language with a tag, most recent first"""
+        return [self.articles[i] for i in self.ids_by_language.get(language, {}).get(tag, [])]
@@ -0,0 +1,73 @@
+import ast
+import builtins
+import os
+
+# names available to every template without being passed in the context
+TEMPLATE_GLOBALS = {"os": os}
+
+class Template:
+    """An html template compiled once into a render function.
+
+    Templates are written as the body of a python f-string. The source is
+    turned into a function taking the names used by the template as keyword
+    arguments, so rendering is a plain function call.
+    """
+    def __init__(self, source, filename="<template>"):
+        self.filename = filename
+        self.source = source
+        expression = ast.parse(f"f'''{source}'''", filename, mode="eval").body
+        self.names = Template.free_names(expression)
+
+        # def render(*, name1, name2, **unused): return f'''...'''
+        parameters = "".join(f"{name}, " for name in self.names)
+        module = ast.parse(f"def render(*, {parameters}**unused): return None", filename)
+        module.body[0].body[0].value = expression
+        module = ast.fix_missing_locations(module)
+        namespace = dict(TEMPLATE_GLOBALS)
+        exec(compile(module, filename, "exec"), namespace)
+        self.render_function = namespace["render"]
+
+    @staticmethod
+    def free_names(expression):
+        """Names read by the template that must come from the context"""
+        loaded = []
+        stored = set()
+        for node in ast.walk(expression):
+            if isinstance(node, ast.Name):
+                if isinstance(node.ctx, ast.Load):
+                    if node.id not in loaded:
+                        loaded.append(node.id)
+                else:
+                    stored.add(node.id)
+        return [name for name in loaded if name not in stored and name not in TEMPLATE_GLOBALS and not hasattr(builtins, name)]
+
+    def render(self, **context):
+        return self.render_function(**context)
+
+class TemplateLoader:
+    """Load templates from a directory and keep them compiled in memory"""
+    def __init__(self, template_dir="templates"):
+        self.template_dir = template_dir
+        # filename -> (mtime, compiled template)
+        self.cache = {}
+
+    def path(self, filename):
+        return os.path.join(self.template_dir, filename)
+
+    def get(self, filename):
+        path = self.path(filename)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self.cache.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'r') as file:
+            template = Template(file.read(), path)
+        self.cache[filename] = (mtime, template)
+        return template
+
+    def render(self, filename, **context):
+        return self.get(filename).render(**context)
+
+    def __getstate__(self):
+        # compiled functions cannot be pickled, worker processes compile their own
+        return {"template_dir": self.template_dir, "cache": {}}
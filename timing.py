@@ -0,0 +1,75 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+
+class BuildProfile:
+    """Time spent in each stage of a build and on each article.
+
+    Stages are always timed (it costs nothing), the report is only written
+    when profiling was asked for. Article times are split into load (front
+    matter), markdown (body and snippet rendering) and render (templates,
+    links and images rewriting, write).
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.start()
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.stages = {}
+        # markdown file -> {"title", "load", "markdown", "render"}
+        self.articles = {}
+        self.bytes_written = 0
+        self.files_written = 0
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - start
+
+    def add_article(self, article, phase, seconds):
+        if not self.enabled:
+            return
+        entry = self.articles.setdefault(article.md_file_path, {"title": article.title, "load": 0, "markdown": 0, "render": 0})
+        entry[phase] += seconds
+
+    def count_write(self, nb_bytes, nb_files=1):
+        self.bytes_written += nb_bytes
+        self.files_written += nb_files
+
+    def slowest_articles(self):
+        return sorted(self.articles.items(), key=lambda item: item[1]["load"] + item[1]["markdown"] + item[1]["render"], reverse=True)
+
+    def report(self, **extra):
+        return {
+            "total": time.perf_counter() - self.start_time,
+            "stages": self.stages,
+            "bytes_written": self.bytes_written,
+            "files_written": self.files_written,
+            **extra,
+            "articles": [dict(md_file=md_file, **entry) for md_file, entry in self.slowest_articles()],
+        }
+
+    def write(self, path, **extra):
+        report = self.report(**extra)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+        return report
+
+    def table(self, top=10):
+        """Readable summary: stages, then the slowest articles"""
+        lines = [f"{'stage':24} {'ms':>10}"]
+        for name, seconds in self.stages.items():
+            lines.append(f"{name:24} {seconds*1000:10.1f}")
+        lines.append(f"{self.files_written} files written, {self.bytes_written} bytes")
+        lines.append("")
+        lines.append(f"{'load ms':>8} {'markdown ms':>12} {'render ms':>10} {'total ms':>9}  article")
+        for md_file, entry in self.slowest_articles()[:top]:
+            total = entry["load"] + entry["markdown"] + entry["render"]
+            lines.append(f"{entry['load']*1000:8.1f} {entry['markdown']*1000:12.1f} {entry['render']*1000:10.1f} {total*1000:9.1f}  {entry['title']}")
+        return "\n".join(lines)
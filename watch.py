@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+
+class Watcher:
+    """Poll directories and report the files added, modified or deleted.
+
+    Changes are debounced: once something changed, the watcher waits until
+    nothing moved for `debounce` seconds so that an editor saving several
+    files (or writing a file in several steps) triggers a single rebuild.
+    """
+    def __init__(self, dirs, interval=0.1, debounce=0.05):
+        self.dirs = dirs
+        self.interval = interval
+        self.debounce = debounce
+        self.state = self.snapshot(dirs)
+
+    @staticmethod
+    def snapshot(dirs):
+        state = {}
+        for directory in dirs:
+            for root, subdirs, files in os.walk(directory):
+                for file in files:
+                    path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    state[path] = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def poll(self):
+        """Paths that changed since the last poll"""
+        state = self.snapshot(self.dirs)
+        changed = {path for path in state.keys() | self.state.keys() if state.get(path) != self.state.get(path)}
+        self.state = state
+        return changed
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def wait(self):
+        """Block until something changed and return the set of changed paths"""
+        changed = set()
+        while True:
+            self.sleep(self.debounce if changed else self.interval)
+            new_changes = self.poll()
+            if changed and not new_changes:
+                return changed
+            changed |= new_changes
+
+    def __iter__(self):
+        while True:
+            yield self.wait()
+
+class EventWatcher(Watcher):
+    """Watcher woken by the notifications of the file system (inotify on Linux).
+
+    Uses the optional watchdog package. Only the paths named by the events
+    are looked at again, so an idle watcher costs nothing and a change is
+    seen in the same time whatever the number of files. A directory created,
+    removed or moved is walked to report the files it holds.
+    """
+    def __init__(self, dirs, debounce=0.05):
+        # woken by the events, the interval only bounds the wait for Ctrl+C
+        super().__init__(dirs, 1.0, debounce)
+        self.lock = threading.Lock()
+        # paths named by the events since the last poll -> whether they are directories
+        self.touched = {}
+        self.woken = threading.Event()
+        handler = FileSystemEventHandler()
+        handler.on_any_event = self.notify
+        self.observer = Observer()
+        for directory in dirs:
+            if os.path.isdir(directory):
+                self.observer.schedule(handler, directory, recursive=True)
+        self.observer.daemon = True
+        self.observer.start()
+
+    @staticmethod
+    def available():
+        return Observer is not None
+
+    def notify(self, event):
+        # the files of a directory have their own events, only a directory appearing or disappearing is walked
+        if event.is_directory and event.event_type not in ("created", "deleted", "moved"):
+            return
+        paths = [os.fsdecode(path) for path in (event.src_path, getattr(event, "dest_path", "")) if path]
+        with self.lock:
+            for path in paths:
+                self.touched[path] = self.touched.get(path, False) or event.is_directory
+        self.woken.set()
+
+    def sleep(self, seconds):
+        self.woken.wait(seconds)
+
+    def poll(self):
+        with self.lock:
+            touched, self.touched = self.touched, {}
+            self.woken.clear()
+        changed = set()
+        for path, is_directory in touched.items():
+            if is_directory:
+                # the files of a directory, or of a directory that is no longer there
+                prefix = os.path.join(path, "")
+                old = {p: value for p, value in self.state.items() if p.startswith(prefix)}
+                new = self.snapshot([path]) if os.path.isdir(path) else {}
+            else:
+                old = {path: self.state[path]} if path in self.state else {}
+                try:
+                    stat = os.stat(path)
+                    new = {path: (stat.st_mtime_ns, stat.st_size)}
+                except FileNotFoundError:
+                    new = {}
+            for p in old.keys() | new.keys():
+                if old.get(p) != new.get(p):
+                    changed.add(p)
+                    if p in new:
+                        self.state[p] = new[p]
+                    else:
+                        del self.state[p]
+        return changed
+
+def watcher(dirs):
+    """Watcher of dirs, woken by the file system when watchdog is installed, polling otherwise"""
+    return EventWatcher(dirs) if EventWatcher.available() else Watcher(dirs)
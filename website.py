@@ -1,8 +1,42 @@
 import argparse
+import cProfile
 import os,shutil
+import json
+import hashlib
+from urllib.parse import quote, urlparse
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
-from articles import Article
-import math,re
+from articles import Article, ArticleRecord, supported_languages
+import renderers
+from renderers import ASSET_DIR_MARKER
+from manifest import BuildManifest, hash_text
+from templating import TemplateLoader
+from cache import DiskCache
+import highlight
+from highlight import HighlightCache
+from publish import AssetPublisher, AssetFingerprints
+from optimize import AssetOptimizer, first_block
+from output import OutputWriter
+from compress import precompress, remove_copies, remove_outdated_copies
+from images import ResponsiveImages, is_resizable
+import fnmatch
+from watch import EventWatcher, watcher
+from preview import PreviewServer
+from tags import TagIndex
+from search import SearchIndex
+from feeds import ContentDates, SITEMAP_MAX_URLS, atom_feed, iso_datetime, sitemap, sitemap_index
+from timing import BuildProfile
+from shards import SHARDS_VERSION, check_listings, listing_path, parse_shard, read_json, shard_dir, shard_of, snapshot_path, write_json
+import math,time
+
+# width of the images in the pages, for the browser to pick a variant in srcset
+ARTICLE_IMAGE_SIZES = "(max-width: 1000px) 90vw, 825px"
+THUMBNAIL_IMAGE_SIZES = "(max-width: 500px) 90vw, 400px"
+# where the articles go in an index page, they are written one at a time
+PAGE_ARTICLES_MARKER = "\0html_articles\0"
+FRONT_MATTER_CACHE_MAX_SIZE = 16 * 1024 * 1024
+# placeholder and message of the search widget
+SEARCH_LABELS = {"fr": ("Rechercher", "Aucun résultat"), "en": ("Search", "No results")}
 
 class Configuration:
     def __init__(self):
@@ -10,14 +44,45 @@ class Configuration:
         self.md_dir = os.getenv("MARKDOWN_DIR")
         self.html_dir = os.getenv("HTML_DIR")
         self.css_file = os.getenv("CSS_FILE", "style.css")
+        # minified css and js, critical css inlined in the pages
+        self.optimize_assets = os.getenv("OPTIMIZE_ASSETS", "true").lower() == "true"
         self.top_tags = int(os.getenv("TOP_TAGS", 10))
         self.nb_articles_per_page = int(os.getenv("NB_ARTICLES_PER_PAGE", 5))
         self.show_full_content = os.getenv("SHOW_FULL_CONTENT", "true").lower() == "true"
         
         # Multilingual configuration
         self.default_language = os.getenv("DEFAULT_LANGUAGE", "fr")
-        self.supported_languages = os.getenv("SUPPORTED_LANGUAGES", "fr,en").split(",")
+        self.supported_languages = supported_languages()
         self.site_url = os.getenv("SITE_URL", "https://example.com")
+        # author of the Atom feeds, the host of SITE_URL by default
+        self.site_author = os.getenv("SITE_AUTHOR", "") or urlparse(self.site_url).netloc
+        # latest articles of each Atom feed
+        self.feed_entries = int(os.getenv("FEED_ENTRIES", 20))
+
+        # Build state (manifest, caches) is kept outside of the html dir
+        self.cache_dir = os.getenv("CACHE_DIR", ".cache")
+        # metadata snapshot and outputs of the shards of a sharded build
+        self.shards_dir = os.getenv("SHARDS_DIR", "shards")
+        self.cache_max_size = int(os.getenv("CACHE_MAX_SIZE_MB", 256)) * 1024 * 1024
+        self.highlight_cache_max_size = int(os.getenv("HIGHLIGHT_CACHE_MAX_SIZE_MB", 64)) * 1024 * 1024
+
+        # files of the article directories published even when no article links to them
+        self.publish_allowlist = [p.strip() for p in os.getenv("PUBLISH_ALLOWLIST", "").split(",") if p.strip()]
+        # "link": hardlink or reflink published files to their source when possible, "copy": always copy
+        self.asset_link_mode = os.getenv("ASSET_LINK_MODE", "link")
+        # write .gz/.br copies of the html, css and js files for nginx gzip_static
+        self.precompress = os.getenv("PRECOMPRESS", "false").lower() == "true"
+        # resized variants of the png and jpeg images, when Pillow is installed
+        self.responsive_images = os.getenv("RESPONSIVE_IMAGES", "true").lower() == "true" and ResponsiveImages.available()
+        self.image_widths = [int(w) for w in os.getenv("IMAGE_WIDTHS", "240,480,800,1200").split(",") if w.strip()]
+        # keep only compact records of the articles, bodies are read again when a page needs them
+        self.low_memory = os.getenv("LOW_MEMORY", "false").lower() == "true"
+        # search index and search widget of the index pages
+        self.search_index = os.getenv("SEARCH_INDEX", "true").lower() == "true"
+        # pages reference the css and js files of assets under content-hashed names
+        self.fingerprint_assets = os.getenv("FINGERPRINT_ASSETS", "true").lower() == "true"
+        # "python-markdown", or "commonmark" when markdown-it-py is installed
+        self.markdown_renderer = renderers.available_renderer(os.getenv("MARKDOWN_RENDERER", renderers.DEFAULT_RENDERER))
         
         self.config = {
             "md_dir": self.md_dir,
@@ -27,53 +92,609 @@ class Configuration:
             "show_full_content": self.show_full_content,
             "default_language": self.default_language,
             "supported_languages": self.supported_languages,
-            "site_url": self.site_url
+            "site_url": self.site_url,
+            "site_author": self.site_author,
+            "feed_entries": self.feed_entries,
+            "css_file": self.css_file,
+            "optimize_assets": self.optimize_assets,
+            "responsive_images": self.responsive_images,
+            "image_widths": self.image_widths,
+            "search_index": self.search_index,
+            "markdown_renderer": self.markdown_renderer,
+            "fingerprint_assets": self.fingerprint_assets
         }
 
     def get(self, key):
         return self.config[key]
+
+    def fingerprint(self):
+        """Hash of the settings that have an influence on the generated pages"""
+        return hash_text(json.dumps(self.config, sort_keys=True))
     
 class Website:
-    def __init__(self,conf):
+    def __init__(self,conf,incremental=False,jobs=1,use_cache=True,profile=False,profile_top=10,low_memory=False,shard=None):
         self.config = conf
+        # number of worker processes used to parse and render articles
+        self.jobs = jobs
+        # (i, N) when this build only produces the outputs of shard i of N
+        self.shard = shard
+        self.snapshot_digest = None
+        # outputs a watch rebuild generates again, the others are kept as they are
+        self.scope = None
+        # the manifest is always written, but only used to skip outputs in incremental mode
+        self.manifest = BuildManifest(os.path.join(conf.cache_dir, "build-manifest.json"), conf.html_dir, incremental)
+        # parsed articles are kept across builds, keyed by content hash
+        self.cache = DiskCache(os.path.join(conf.cache_dir, "articles.sqlite"), "articles", conf.cache_max_size) if use_cache else None
+        # highlighted code blocks, reused when an article is rendered again after an edit
+        self.highlights = HighlightCache(DiskCache(os.path.join(conf.cache_dir, "highlights.sqlite"), "highlights", conf.highlight_cache_max_size)) if use_cache else None
+        # front matters of the markdown files, by path, mtime and size
+        self.front_matters = DiskCache(os.path.join(conf.cache_dir, "front-matters.sqlite"), "front_matters", FRONT_MATTER_CACHE_MAX_SIZE) if use_cache else None
+        highlight.install(self.highlights)
+        renderers.use(conf.markdown_renderer)
+        self.templates = TemplateLoader("templates")
+        # every generated file is written through it, unless its content did not change
+        self.output = OutputWriter()
+        self.publisher = AssetPublisher(self.manifest, conf.asset_link_mode)
+        self.optimizer = AssetOptimizer(conf.cache_dir, self.manifest, conf.optimize_assets)
+        self.assets = AssetFingerprints(self.manifest, self.publisher, self.output, "assets", conf.fingerprint_assets, self.optimizer)
+        self.images = ResponsiveImages(conf.cache_dir, self.publisher, conf.image_widths) if conf.responsive_images else None
+        self.search = SearchIndex(self.manifest, self.output, self.cache) if conf.search_index else None
+        self.content_dates = ContentDates(os.path.join(conf.cache_dir, "content-dates.json"), self.manifest)
+        self.profile = BuildProfile(profile)
+        self.low_memory = low_memory or conf.low_memory
+        self.profile_top = profile_top
+        # files of the markdown directory to publish, by article
+        self.article_files = {}
+        # articles parsed so far, by markdown file
+        self.loaded_articles = {}
         self.articles = []
-        self.articles_by_tag = {}
+        self.tag_index = TagIndex()
         self.articles_by_language = {}  # New: articles grouped by language
+        # article directory -> {language: (markdown file, url path)}
+        self.translations = {}
 
     # get list of all markdown files
     def get_markdown_files(self):
         md_files = []
+        self.translations = {}
         for root, dirs, files in os.walk(self.config.md_dir):
             for file in files:
                 # Only include supported language files
-                if file in ['fr.md', 'en.md']:
+                if self.is_language_file(file):
                     md_files.append(os.path.join(root, file))
+                    self.add_translation(md_files[-1])
         return md_files
 
+    def is_language_file(self, filename):
+        return filename.endswith(".md") and filename[:-3] in self.config.supported_languages
+
+    def add_translation(self, md_file):
+        """Register a markdown file in the translation index, with the url path of its page"""
+        article_dir, filename = os.path.split(md_file)
+        # year/month/day/article/lang.md
+        path_parts = os.path.relpath(md_file, self.config.md_dir).split("/")
+        url_path = "/".join(path_parts[:-1]) if len(path_parts) >= 4 else None
+        variants = self.translations.setdefault(article_dir, {})
+        variants[filename[:-3]] = (md_file, url_path)
+        # same order whatever the file system
+        self.translations[article_dir] = dict(sorted(variants.items()))
+
+    def remove_translation(self, md_file):
+        article_dir, filename = os.path.split(md_file)
+        variants = self.translations.get(article_dir, {})
+        variants.pop(filename[:-3], None)
+        if not variants:
+            self.translations.pop(article_dir, None)
+
+    def get_translations(self, article):
+        """Language variants of an article, from the translation index"""
+        return self.translations.get(article.get_translations_dir(), {})
+
     # clean html dir
     def clean_html_dir(self):
         # delete html dir
         shutil.rmtree(self.config.html_dir,ignore_errors=True)
         os.makedirs(self.config.html_dir)
 
-    def init_html(self):
-        self.clean_html_dir()
-        # copy md_dir to html_dir  # cp -r md_dir/* html_dir
-        shutil.copytree(self.config.md_dir, self.config.html_dir, dirs_exist_ok=True)
-        # copy assets to html_dir/assets
-        assets_dir = os.path.join(self.config.html_dir, "assets")
-        os.makedirs(assets_dir, exist_ok=True)
-        shutil.copytree("assets", assets_dir, dirs_exist_ok=True)
-        # copy static files to html_dir
-        static_dir = os.path.join(self.config.html_dir)
-        os.makedirs(static_dir, exist_ok=True)
-        shutil.copytree("static", static_dir, dirs_exist_ok=True)
-
-    def init_articles(self):
-        md_files = self.get_markdown_files()
-        # create one article object per markdown file
+    def is_markdown_file(self, path):
+        return path.startswith(os.path.join(self.config.md_dir, "")) and self.is_language_file(os.path.basename(path))
+
+    def init_html(self, changed=None):
+        self.prepare_html_dir()
+        # in a sharded build, assets and static files are published by the shard of the "site" unit
+        site = self.owns("site")
+        if site:
+            # copy assets to html_dir/assets
+            self.copy_tree("assets", os.path.join(self.config.html_dir, "assets"), changed)
+            nb_bytes = self.assets.publish(os.path.join(self.config.html_dir, "assets"))
+            if nb_bytes:
+                self.profile.count_write(nb_bytes)
+        if self.images:
+            # the static pages use the variants of the images in assets
+            for root, dirs, files in os.walk("assets"):
+                for file in sorted(files):
+                    if is_resizable(file):
+                        src = os.path.join(root, file)
+                        self.images.prepare(src, self.config.html_dir, src, site)
+        if site:
+            # copy static files to html_dir
+            self.copy_tree("static", self.config.html_dir, changed)
+
+    def prepare_html_dir(self):
+        if self.manifest.incremental or self.manifest.previous["outputs"]:
+            # keep previous outputs, unchanged files are not written again and stale ones are removed at the end of the build
+            os.makedirs(self.config.html_dir, exist_ok=True)
+        else:
+            self.clean_html_dir()
+
+    def owns(self, unit):
+        """Whether this build produces the outputs of a unit of work, always true unless the build is sharded"""
+        return self.shard is None or shard_of(unit, self.shard[1]) == self.shard[0]
+
+    def in_scope(self, output):
+        """Whether an output may have to be generated again, always true unless a watch rebuild is limited to some pages"""
+        return self.scope is None or output in self.scope
+
+    def article_unit(self, article):
+        # the translations of an article share their directory and its files
+        return f"article:{os.path.relpath(article.get_translations_dir(), self.config.md_dir)}"
+
+    def copy_tree(self, src_dir, dst_dir, changed=None):
+        """Publish src_dir into dst_dir, skipping files whose content did not change"""
+        if changed is not None:
+            self.copy_changed_files(src_dir, dst_dir, changed)
+            return
+        for root, dirs, files in os.walk(src_dir):
+            out_root = os.path.normpath(os.path.join(dst_dir, os.path.relpath(root, src_dir)))
+            os.makedirs(out_root, exist_ok=True)
+            for file in files:
+                src = os.path.join(root, file)
+                self.publish_file(src, os.path.join(out_root, file))
+
+    def copy_changed_files(self, src_dir, dst_dir, changed):
+        """Publish the changed files of src_dir, the other files of the previous build are kept as is"""
+        prefix = os.path.join(src_dir, "")
+        to_publish = {src for src in changed if src.startswith(prefix) and os.path.isfile(src)}
+        for output, entry in self.manifest.previous["outputs"].items():
+            inputs = entry["inputs"]
+            if not inputs[0].startswith(prefix):
+                continue
+            if changed.isdisjoint(inputs) and not ("assets" in inputs and self.manifest.input_changed("assets")):
+                self.manifest.keep(output)
+            elif os.path.isfile(inputs[0]):
+                # a page of static/ using a modified image, css or js
+                to_publish.add(inputs[0])
+        for src in sorted(to_publish):
+            self.publish_file(src, os.path.normpath(os.path.join(dst_dir, os.path.relpath(src, src_dir))))
+
+    def publish_file(self, src, dst):
+        """Publish a file of assets/ or static/, html pages get the responsive images attributes and the hashed asset names"""
+        if not (self.images or self.assets.names) or not src.endswith(".html"):
+            self.publisher.publish(self.assets.published_file(src), dst, src)
+            return
+        with open(src, 'r', encoding='utf-8') as f:
+            html = f.read()
+        sources = []
+        if self.images:
+            html = self.images.rewrite(html, os.path.dirname(os.path.relpath(dst, self.config.html_dir)), ARTICLE_IMAGE_SIZES, sources)
+        assets_url = os.path.relpath(os.path.join(self.config.html_dir, "assets"), os.path.dirname(dst)) + "/"
+        html = self.assets.rewrite(html, assets_url)
+        if self.manifest.check(dst, [src, "settings", "assets"] + self.image_inputs() + sorted(set(sources))):
+            return
+        self.write_page(dst, html)
+
+    def collect_article_files(self, changed=None):
+        """Files of the markdown directory used by each article, and the allowlisted ones"""
+        if changed is None:
+            self.article_files = {}
+        else:
+            # an added or removed file can change what is published for its directory
+            changed_dirs = {os.path.dirname(path) for path in changed}
+            for md_file in list(self.article_files):
+                if md_file not in self.loaded_articles or os.path.dirname(md_file) in changed_dirs:
+                    del self.article_files[md_file]
+
+        for md_file, article in self.loaded_articles.items():
+            if md_file not in self.article_files or article is not self.article_files[md_file][0]:
+                self.article_files[md_file] = (article, self.files_of_article(md_file, article))
+
+    def files_of_article(self, md_file, article):
+        """Files of the directory of an article that are published with it"""
+        article_dir = os.path.dirname(md_file)
+        article_files = article.referenced_files()
+        for file in sorted(os.listdir(article_dir)) if self.config.publish_allowlist else []:
+            path = os.path.join(article_dir, file)
+            if any(fnmatch.fnmatch(file, pattern) for pattern in self.config.publish_allowlist) and os.path.isfile(path):
+                article_files.append(path)
+        return article_files
+
+    def publish_article_files(self, changed=None):
+        """Publish the files of the markdown directory used by the articles, and the allowlisted ones"""
+        if self.shard is None:
+            # a sharded build has the files of the snapshot
+            self.collect_article_files(changed)
+        files = set()
+        for article, article_files in self.article_files.values():
+            files.update(article_files)
+
+        # published files keep their place in the markdown directory tree
+        for src in sorted(files):
+            rel_path = os.path.relpath(src, self.config.md_dir)
+            # each file is published by one shard, the others only need the sizes of the images
+            publish = self.owns(f"file:{rel_path}")
+            if publish:
+                self.publisher.publish(src, os.path.join(self.config.html_dir, rel_path))
+            if self.images and is_resizable(src):
+                self.images.prepare(src, self.config.html_dir, rel_path, publish)
+
+    def image_files(self, article):
+        """Images of an article, their size and variants appear in the pages"""
+        if not self.images:
+            return []
+        return [path for path in self.article_files[article.md_file_path][1] if is_resizable(path)]
+
+    def image_inputs(self):
+        """Input of the pages listing image variants, changes with how the variants are made"""
+        return ["responsive_images"] if self.images else []
+
+    def remove_stale_outputs(self):
+        """Delete the outputs of the previous build that were not generated this time"""
+        html_dir = os.path.normpath(self.config.html_dir)
+        for output in self.manifest.removed_outputs():
+            if not os.path.exists(output):
+                continue
+            print(f"Removing {output}")
+            # with its compressed copies, so that its directory can be removed
+            for path in (output, output + ".gz", output + ".br"):
+                if os.path.exists(path):
+                    os.remove(path)
+            # remove directories left empty
+            out_dir = os.path.dirname(output)
+            while os.path.normpath(out_dir) != html_dir and os.path.isdir(out_dir) and not os.listdir(out_dir):
+                os.rmdir(out_dir)
+                out_dir = os.path.dirname(out_dir)
+
+    def write_page(self, path, html):
+        """Write a generated page, return its size"""
+        return self.write_page_parts(path, [html])
+
+    def write_page_parts(self, path, parts):
+        """Write a page given as an iterable of strings through the output writer, return its size"""
+        size = self.output.write(path, parts)
+        self.profile.count_write(size)
+        return size
+
+    def build(self, changed=None):
+        """Generate the website, changed is the set of source files modified since the last build of this object"""
+        self.profile.start()
+        self.manifest.start(changed)
+        self.manifest.set_input("settings", self.config.fingerprint())
+        self.output.start()
+        self.publisher.start()
+        self.optimizer.start(os.path.join("assets", self.config.css_file))
+        self.assets.start()
+        if self.images:
+            self.images.start()
+        with self.profile.stage("init_html"):
+            self.init_html(changed)
+        with self.profile.stage("init_articles"):
+            if self.shard:
+                self.load_snapshot()
+            else:
+                self.init_articles(changed)
+        with self.profile.stage("publish_article_files"):
+            self.publish_article_files(changed)
+        with self.profile.stage("render_articles"):
+            self.render_articles()
+
+        with self.profile.stage("generate_index"):
+            self.generate_index()
+
+        with self.profile.stage("generate_tag_pages"):
+            self.generate_tag_pages()
+
+        with self.profile.stage("generate_articles"):
+            self.generate_articles()
+
+        if self.shard:
+            # the merge writes them for all the shards
+            with self.profile.stage("shard_metadata"):
+                metadata = self.shard_metadata()
+        else:
+            with self.profile.stage("generate_search_index"):
+                self.generate_search_index()
+
+            with self.profile.stage("generate_feeds"):
+                self.generate_feeds()
+
+        with self.profile.stage("write_outputs"):
+            self.output.flush()
+
+        with self.profile.stage("cleanup"):
+            self.cleanup(changed)
+        self.manifest.save()
+        if self.shard:
+            self.write_shard_listing(metadata)
+        print(f"{self.manifest.nb_built} files generated, {self.manifest.nb_skipped} up to date")
+        print(self.output.stats())
+        print(self.publisher.stats())
+        if self.optimizer.enabled:
+            self.critical_css_report()
+            print(self.optimizer.stats())
+        if self.cache:
+            self.cache.close()
+            print(self.cache.stats())
+        if self.highlights:
+            self.highlights.close()
+            print(self.highlights.stats())
+        if self.front_matters:
+            self.front_matters.close()
+        if self.profile.enabled:
+            self.write_profile()
+
+    def cleanup(self, changed=None):
+        """Remove the stale outputs, write or remove the compressed copies"""
+        self.remove_stale_outputs()
+        # a watch rebuild knows the files it wrote, the html dir is not walked
+        paths = self.manifest.built if changed is not None else None
+        if self.config.precompress:
+            # threads, not sized like the pool of article workers which defaults to one process
+            precompress(self.config.html_dir, paths=paths)
+        elif self.manifest.incremental:
+            remove_outdated_copies(self.config.html_dir, paths)
+        else:
+            # the html dir is no longer emptied by full builds
+            remove_copies(self.config.html_dir)
+
+    def write_snapshot(self):
+        """Write the metadata of every article, shared by the shards of a build so that they never read each other's markdown files"""
+        self.manifest.start()
+        self.init_articles()
+        self.collect_article_files()
+        articles = [dict(ArticleRecord(article).metadata(), md_file=md_file, files=self.article_files[md_file][1])
+                    for md_file, article in self.loaded_articles.items()]
+        path = snapshot_path(self.config.shards_dir)
+        write_json(path, {"version": SHARDS_VERSION, "md_dir": self.config.md_dir, "articles": articles})
+        if self.front_matters:
+            self.front_matters.close()
+        print(f"Snapshot of {len(articles)} articles written to {path}")
+
+    def load_snapshot(self):
+        """Load the articles from the metadata snapshot instead of their markdown files"""
+        path = snapshot_path(self.config.shards_dir)
+        snapshot, digest = read_json(path)
+        if snapshot is None or snapshot.get("version") != SHARDS_VERSION or snapshot.get("md_dir") != self.config.md_dir:
+            raise ValueError(f"no snapshot of {self.config.md_dir} in {path}, run website.py snapshot first")
+        self.snapshot_digest = digest
+        self.loaded_articles = {}
+        self.translations = {}
+        self.article_files = {}
+        for entry in snapshot["articles"]:
+            # bodies are read from the markdown file only by the pages that show them
+            article = ArticleRecord.from_metadata(entry["md_file"], entry, self.cache)
+            self.loaded_articles[article.md_file_path] = article
+            self.article_files[article.md_file_path] = (article, entry["files"])
+            self.add_translation(article.md_file_path)
+        self.index_articles()
+
+    def shard_metadata(self):
+        """Content dates and search terms of the articles of this shard, for the feeds, sitemaps and search index written by the merge"""
+        self.content_dates.start()
+        scores = {}
+        for article in self.articles:
+            if self.owns(self.article_unit(article)):
+                self.content_dates.updated(article)
+                if self.search:
+                    scores[article.md_file_path] = self.search.scores(article)
+        self.content_dates.save()
+        return {"content_dates": self.content_dates.dates, "search": scores}
+
+    def write_shard_listing(self, metadata):
+        """Write the outputs of this shard next to its html dir, with the metadata of its articles"""
+        index, count = self.shard
+        html_dir = self.config.html_dir
+        outputs = sorted(os.path.relpath(output, html_dir) for output in self.manifest.outputs)
+        write_json(listing_path(html_dir), dict(metadata, version=SHARDS_VERSION, shard=index, count=count, snapshot=self.snapshot_digest, outputs=outputs))
+        print(f"Shard {index}/{count}: {len(outputs)} outputs")
+
+    def expected_outputs(self):
+        """Pages and article files that the shards of a build must produce, relative to the html dir"""
+        pages = [os.path.join(self.config.html_dir, "index.html")] + [article.path for article in self.articles]
+        for language in self.articles_by_language:
+            pages += [self.index_page_path(language, page) for page in range(self.index_page_count(language))]
+            pages += [self.tag_page_path(language, tag) for tag in self.tag_index.tags(language)]
+        outputs = {os.path.relpath(page, self.config.html_dir) for page in pages}
+        outputs.update(os.path.relpath(src, self.config.md_dir) for article, files in self.article_files.values() for src in files)
+        return outputs
+
+    def merge(self, count):
+        """Combine the outputs of the N shards of a build into the html dir, return the problems found.
+
+        Nothing is written when an output is missing or produced by two
+        shards. The feeds, sitemaps and search index are written from the
+        content dates and search terms listed by the shards.
+        """
+        self.manifest.start()
+        self.manifest.set_input("settings", self.config.fingerprint())
+        self.output.start()
+        self.publisher.start()
+        self.load_snapshot()
+        listings = []
+        for index in range(count):
+            directory = shard_dir(self.config.shards_dir, index, count)
+            listings.append((directory, read_json(os.path.join(directory, "shard.json"))[0]))
+        problems, owners = check_listings(listings, count, self.snapshot_digest, self.expected_outputs())
+        if problems:
+            return problems
+        content_dates = {}
+        scores = {}
+        for directory, listing in listings:
+            content_dates.update(listing["content_dates"])
+            scores.update(listing["search"])
+        for article in self.articles:
+            if article.md_file_path not in content_dates or (self.search and article.md_file_path not in scores):
+                problems.append(f"{article.md_file_path}: no metadata from its shard")
+        if problems:
+            return problems
+
+        self.prepare_html_dir()
+        for output, index in sorted(owners.items()):
+            self.publisher.publish(os.path.join(listings[index][0], "html", output), os.path.join(self.config.html_dir, output))
+        if self.search:
+            self.search.known_scores = scores
+            self.generate_search_index()
+        self.generate_feeds(content_dates)
+        self.output.flush()
+        self.cleanup()
+        self.manifest.save()
+        print(f"{len(owners)} files merged from {count} shards")
+        print(self.output.stats())
+        print(self.publisher.stats())
+        for cache in (self.cache, self.highlights, self.front_matters):
+            if cache:
+                cache.close()
+        return []
+
+    def write_profile(self):
+        """Write the JSON report of the build and print the slowest articles"""
+        for article in self.articles:
+            self.profile.add_article(article, "markdown", article.markdown_time)
+        path = os.path.join(self.config.cache_dir, "build-profile.json")
+        self.profile.write(path,
+            jobs=self.jobs,
+            incremental=self.manifest.incremental,
+            outputs={"built": self.manifest.nb_built, "up_to_date": self.manifest.nb_skipped},
+            published_files={"linked": self.publisher.nb_linked, "copied": self.publisher.nb_copied, "deduplicated": self.publisher.nb_deduplicated},
+            cache={"hits": self.cache.hits, "misses": self.cache.misses} if self.cache else None,
+            highlight_cache={"hits": self.highlights.hits, "misses": self.highlights.misses} if self.highlights else None)
+        print(self.profile.table(self.profile_top))
+        print(f"profile written to {path}")
+
+    def watch(self):
+        """Build the website, then rebuild what is affected by each change in the sources"""
+        sources = watcher([self.config.md_dir, "templates", "assets", "static"])
+        self.build()
+        # later builds reuse the outputs of the previous one
+        self.manifest.incremental = True
+        print(f"Watching for changes ({'file system events' if isinstance(sources, EventWatcher) else 'polling'}), press Ctrl+C to stop")
+        try:
+            for changed in sources:
+                start = time.perf_counter()
+                if not self.rebuild_pages(changed):
+                    self.build(changed)
+                print(f"Rebuilt {len(changed)} changed files in {(time.perf_counter() - start) * 1000:.0f} ms")
+        except KeyboardInterrupt:
+            pass
+
+    def rebuild_pages(self, changed):
+        """Rebuild after edits of article bodies or templates, return False when the change needs an incremental build.
+
+        Only the pages that depend on a changed file in the manifest are
+        checked and generated again, the other outputs are kept without
+        looking at them. The search index and the feeds, which cover the
+        whole archive, are updated once the pages are written.
+        """
+        if self.shard:
+            return False
+        start = time.perf_counter()
+        templates_dir = os.path.join(self.templates.template_dir, "")
+        md_files = [path for path in changed if self.is_markdown_file(path)]
+        for path in changed:
+            if path in md_files and path not in self.loaded_articles:
+                # an added article moves the others
+                return False
+            if not (path in md_files or path.startswith(templates_dir)) or not os.path.isfile(path):
+                return False
+
+        # the indexes, neighbours and listings stay the same as long as the metadata and files of the articles do
+        articles = {}
+        for md_file in md_files:
+            article = Article(md_file, self.cache, metadata_only=True, front_matters=self.front_matters)
+            old = self.loaded_articles[md_file]
+            if any(getattr(article, name) != getattr(old, name) for name in ArticleRecord.METADATA_FIELDS):
+                return False
+            files = self.files_of_article(md_file, article)
+            if files != self.article_files[md_file][1]:
+                return False
+            articles[md_file] = ArticleRecord(article) if self.low_memory else article, files
+
+        self.manifest.start(changed)
+        affected = {output for path in changed for output in self.manifest.outputs_of(path)}
+        for output in affected:
+            first_input = self.manifest.previous["outputs"][output]["inputs"][0]
+            # pages of articles (from their markdown file) and index and tag pages (from their template)
+            if not (first_input.startswith(templates_dir) or (first_input in self.loaded_articles and self.loaded_articles[first_input].path == output)):
+                return False
+        self.output.start()
+        for output in self.manifest.previous["outputs"]:
+            if output not in affected:
+                self.manifest.keep(output)
+
+        # the new articles take the place of the old ones in the indexes
+        for md_file, (article, files) in articles.items():
+            old = self.loaded_articles[md_file]
+            article.path, article.prev_path, article.next_path = old.path, old.prev_path, old.next_path
+            self.loaded_articles[md_file] = article
+            self.articles[self.articles.index(old)] = article
+            by_language = self.articles_by_language[article.language]
+            by_language[by_language.index(old)] = article
+            self.article_files[md_file] = (article, files)
+
+        self.scope = affected
+        try:
+            self.render_articles()
+            self.generate_index()
+            self.generate_tag_pages()
+            self.generate_articles()
+        finally:
+            self.scope = None
+        self.output.flush()
+        print(f"{self.manifest.nb_built} pages generated in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        if md_files:
+            self.generate_search_index()
+            self.generate_feeds()
+            self.output.flush()
+        self.cleanup(changed)
+        self.manifest.save()
+        print(self.output.stats())
+        return True
+
+    def init_articles(self, changed=None):
+        if changed is None:
+            self.loaded_articles = {}
+            md_files = self.get_markdown_files()
+        else:
+            # only parse again the markdown files that changed
+            md_files = []
+            for path in sorted(changed):
+                if not self.is_markdown_file(path):
+                    continue
+                if os.path.exists(path):
+                    md_files.append(path)
+                    self.add_translation(path)
+                else:
+                    self.loaded_articles.pop(path, None)
+                    self.remove_translation(path)
+        # create one article object per markdown file, only the front matter is read here
+        articles = []
         for md_file in md_files:
-            article = Article(md_file)
+            start = time.perf_counter()
+            article = Article(md_file, self.cache, metadata_only=True, front_matters=self.front_matters)
+            if self.low_memory:
+                # the front matter and the body are not kept
+                article = ArticleRecord(article)
+            articles.append(article)
+            self.profile.add_article(article, "load", time.perf_counter() - start)
+        for article in articles:
+            self.loaded_articles[article.md_file_path] = article
+        self.index_articles()
+
+    def index_articles(self):
+        """Sort, group, link and tag the loaded articles"""
+        self.articles = []
+        self.articles_by_language = {}
+        for article in self.loaded_articles.values():
             self.add(article)
 
         # Group articles by language and sort by date
@@ -101,33 +722,16 @@ class Website:
             if lang in self.articles_by_language:
                 lang_articles = self.articles_by_language[lang]
                 for i, article in enumerate(lang_articles):
+                    article.prev_path = ""
+                    article.next_path = ""
                     if i > 0:
                         article.prev_path = os.path.relpath(lang_articles[i-1].path, os.path.dirname(article.path)) 
                     if i < len(lang_articles) - 1:
                         article.next_path = os.path.relpath(lang_articles[i+1].path, os.path.dirname(article.path))
 
-        # Count tags by language
-        self.sorted_tags_by_language = {}
-        for lang in self.config.get('supported_languages') or ['fr', 'en']:
-            tag_count = {}
-            if lang in self.articles_by_language:
-                for article in self.articles_by_language[lang]:
-                    for tag in article.tags:
-                        if tag not in tag_count:
-                            tag_count[tag] = 0
-                        tag_count[tag] += 1
-                self.sorted_tags_by_language[lang] = [k for k,v in sorted(tag_count.items(), key=lambda x:x[1], reverse=True)]
-        
-        # Keep global sorted tags for backward compatibility 
-        tag_count = {}
-        for article in self.articles:
-            for tag in article.tags:
-                if tag not in tag_count:
-                    tag_count[tag] = 0
-                tag_count[tag] += 1
-        self.sorted_tags = [k for k,v in sorted(tag_count.items(), key=lambda x:x[1], reverse=True)]
+        # tags of every language, in a single pass over the sorted articles
+        self.tag_index.build(self.articles)
 
-    # html article has been created
     def add(self, article):
         self.articles.append(article)
 
@@ -136,31 +740,20 @@ class Website:
             self.articles_by_language[article.language] = []
         self.articles_by_language[article.language].append(article)
 
-        # Group articles by tag (global)
-        for tag in article.tags:
-            if tag not in self.articles_by_tag:
-                self.articles_by_tag[tag] = []
-            self.articles_by_tag[tag].append(article)
-
 
     def get_top_tags(self,top):
         """ Return the top most used tags """
-        return self.sorted_tags[:top]
+        return self.tag_index.sorted_tags[:top]
 
     def get_top_tags_by_language(self, language, top):
         """ Return the top most used tags for a specific language """
-        if language in self.sorted_tags_by_language:
-            return self.sorted_tags_by_language[language][:top]
-        return []
+        return self.tag_index.tags(language)[:top]
 
-    def get_template(self,filename):
-        template_dir = "templates"
-        filename = os.path.join(template_dir, filename)
-        with open(filename, 'r') as file:
-            return file.read()
+    def template_path(self, filename):
+        return self.templates.path(filename)
     
     def get_articles_by_tag(self, tag):
-        return self.articles_by_tag.get(tag, [])
+        return [self.articles[i] for i in self.tag_index.ids.get(tag, [])]
     
     def get_articles_by_date(self, language=None):
         """Sort articles by date, optionally filtered by language"""
@@ -170,82 +763,160 @@ class Website:
             articles = self.articles
         return sorted(articles, key=lambda x: x.date, reverse=True)
     
+    def chunksize(self, nb_tasks):
+        """Number of tasks sent at once to a worker process"""
+        return max(1, nb_tasks // (self.jobs * 4))
+
+    def render_articles(self):
+        """Render the bodies missing from the cache in worker processes, the others are rendered when used"""
+        if self.jobs <= 1:
+            return
+        articles = [article for article in self.articles if self.in_scope(article.path) and self.owns(self.article_unit(article)) and not article.is_cached()]
+        if len(articles) <= 1:
+            return
+        if self.highlights:
+            self.highlights.commit()
+        # no write may be in progress in another thread when the workers are forked
+        self.output.flush()
+        with ProcessPoolExecutor(self.jobs, initializer=init_renderer, initargs=(self.config.markdown_renderer, self.highlights.reader() if self.highlights else None)) as pool:
+            rendered = pool.map(render_article, articles, chunksize=self.chunksize(len(articles)))
+            # the caches are only written by this process
+            for article, (html, markdown_time, highlights) in zip(articles, rendered):
+                article.store(html)
+                article.markdown_time += markdown_time
+                if self.highlights:
+                    self.highlights.merge(highlights)
+
+    def generate_articles(self):
+        """Generate the html page of every article that is not up to date"""
+        # the manifest is only updated by this process, workers just render and write
+        articles = [article for article in self.articles
+                    if self.in_scope(article.path) and self.owns(self.article_unit(article)) and not self.manifest.check(article.path, *self.article_dependencies(article))]
+        if self.jobs > 1 and len(articles) > 1:
+            if self.cache:
+                # workers read the bodies of the low-memory records from the cache
+                self.cache.commit()
+            self.output.flush()
+            with ProcessPoolExecutor(self.jobs, initializer=init_worker, initargs=(self,)) as pool:
+                for article, (seconds, nb_bytes, written) in zip(articles, pool.map(write_html_article, articles, chunksize=self.chunksize(len(articles)))):
+                    print(f"Generating html for article {article.title}")
+                    # pages written by the workers are counted here
+                    self.profile.add_article(article, "render", seconds)
+                    self.profile.count_write(nb_bytes)
+                    self.output.count(written)
+        else:
+            for article in articles:
+                print(f"Generating html for article {article.title}")
+                start = time.perf_counter()
+                self.write_html_article(article)
+                self.profile.add_article(article, "render", time.perf_counter() - start)
+
+    def article_dependencies(self, article):
+        """Inputs and context an article page depends on"""
+        lang_top_tags = self.get_top_tags_by_language(article.language, self.config.top_tags)
+        translations = self.get_translations(article)
+        # the page only depends on its own source and on its links to other articles
+        inputs = [article.md_file_path, self.template_path(self.article_template_name(article)), "settings", "assets", "critical_css"] + self.image_inputs() + self.image_files(article)
+        context = "\n".join([article.prev_path, article.next_path, ",".join(lang_top_tags)] + sorted(md_file for md_file, url_path in translations.values()))
+        return inputs, context
+
+    def language_template_name(self, language, template_name):
+        """Template of a language, xx-name, or the default template when the language has none"""
+        if language != self.config.default_language:
+            language_template_name = f"{language}-{template_name}"
+            if os.path.exists(self.template_path(language_template_name)):
+                return language_template_name
+        return template_name
+
+    def article_template_name(self, article):
+        return self.language_template_name(article.language, "article.html")
+
     # create html file, in html_dir, by transforming the markdown into html
     def generate_html_article(self, article):
+        if self.manifest.check(article.path, *self.article_dependencies(article)):
+            return
+        print(f"Generating html for article {article.title}")
+        self.write_html_article(article)
+
+    def write_html_article(self, article):
         # New structure: html_dir/lang/YYYY/MM/DD/article_dir/index.html
+        self.output.makedirs(os.path.dirname(article.path))
+        return self.write_page(article.path, self.render_html_article(article))
+
+    def render_html_article(self, article):
+        """Html of the page of an article"""
         html_file_path = article.path
         
-        # Ensure the directory exists
-        os.makedirs(os.path.dirname(html_file_path), exist_ok=True)
-        
-        # Calculate relative CSS path from new location
-        css_path = os.path.join(self.config.html_dir, "assets", self.config.css_file)
-        css_rel_path = os.path.relpath(css_path, os.path.dirname(html_file_path))
-        title = article.title
-        
-        # Get top tags for this language
-        lang_top_tags = self.sorted_tags_by_language.get(article.language, [])[:self.config.top_tags]
+        # Get translations for hreflang
+        translations = self.get_translations(article)
+
+        css_rel_path = self.asset_path(self.config.css_file, html_file_path)
         
         # Calculate relative path to tags from article location
-        tags_path = f"../../../../../{article.language}/tags/"
-        html_top_tags = "".join([f'<a href="{tags_path}{tag}.html"><span class="meta-box tag-{i+1}">{tag}</span></a>' for i, tag in enumerate(lang_top_tags)])
+        html_top_tags = self.top_tags_html(article.language, f"../../../../../{article.language}/tags/")
 
-        # Get translations for hreflang
-        translations = article.find_translations()
         hreflang_links = self.generate_hreflang_links(article, translations)
         
         # Language selector
         language_selector = self.generate_language_selector(article, translations)
 
-        html_template = self.get_template("article.html")
-        if article.language == "fr":
-            html_template = self.get_template("article.html")
-        elif article.language == "en":
-            html_template = self.get_template("en-article.html")
-        else:
-            raise ValueError(f"language not supported : {article.language}")
-        rendered_html = eval(f"f'''{html_template}'''")
+        rendered_html = self.templates.render(self.article_template_name(article),
+            article=article,
+            css_rel_path=css_rel_path,
+            theme_toggle_path=self.asset_path("theme-toggle.js", html_file_path),
+            hreflang_links=hreflang_links,
+            language_selector=language_selector,
+            html_top_tags=html_top_tags)
         
-        # Update image paths to point to shared location
+        rendered_html = self.link_article_files(rendered_html, article, html_file_path)
+        rendered_html = self.inline_critical_css(rendered_html, self.article_template_name(article), article.language, css_rel_path, "{article.html}", content=article.html)
         article_rel_path = os.path.relpath(article.path, self.config.html_dir)
-        rendered_html = Website.update_image_paths(rendered_html, article_rel_path)
+        if self.images:
+            rendered_html = self.images.rewrite(rendered_html, os.path.dirname(article_rel_path), ARTICLE_IMAGE_SIZES)
+        return rendered_html
 
-        with open(html_file_path, 'w', encoding='utf-8') as f:
-            f.write(rendered_html)
+    def top_tags_html(self, language, tags_path):
+        """Links to the pages of the top tags of a language, tags_path is the url of the tags directory"""
+        top_tags = self.get_top_tags_by_language(language, self.config.top_tags)
+        return "".join([f'<a href="{tags_path}{tag}.html"><span class="meta-box tag-{i+1}">{tag}</span></a>' for i, tag in enumerate(top_tags)])
 
-    def update_image_paths(content, article_path):
-        # Get the directory of the article
-        article_dir = os.path.dirname(article_path)
-        
-        # For multilingual articles, images are in the shared location
-        # Convert from fr/2025/11/10/floating-point to 2025/11/10/floating-point  
-        shared_path = article_dir
-        if article_dir.startswith('fr/') or article_dir.startswith('en/'):
-            shared_path = article_dir.split('/', 1)[1]  # Remove language prefix
-        
-        # Define the regex pattern to match the <a href> tags with specific suffixes
-        href_pattern = r'(<a href="([^"]+\.(?:png|jpg|jpeg|svg|excalidraw|txt))">)'
-        
-        # Define the regex pattern to match the <img src> tags with specific suffixes
-        src_pattern = r'(<img[^>]*\s+src="([^"]+\.(?:png|jpg|jpeg|svg))"[^>]*>)'
-        
-        def replace_path(match, pattern_type):
-            if pattern_type == 'href':
-                full_tag, href = match.groups()
-                # Create relative path to shared image location
-                full_path = f"../../../../../{shared_path}/{href}"
-                return full_tag.replace(f'href="{href}"', f'href="{full_path}"')
-            elif pattern_type == 'src':
-                full_tag, src = match.groups()
-                # Create relative path to shared image location  
-                full_path = f"../../../../../{shared_path}/{src}"
-                return full_tag.replace(f'src="{src}"', f'src="{full_path}"')
-        
-        # Use re.sub with a replacement function, ignoring case
-        updated_content = re.sub(href_pattern, lambda m: replace_path(m, 'href'), content, flags=re.IGNORECASE)
-        updated_content = re.sub(src_pattern, lambda m: replace_path(m, 'src'), updated_content, flags=re.IGNORECASE)
-        
-        return updated_content
+    def critical_css(self, template_name, language, placeholder, embedded_template_name=None, content=""):
+        """Critical css of a page: the rules used by its first screen, the layout above the content placeholder
+        (header, navigation, title), and the first block of its first article"""
+        layout = self.templates.get(template_name).source.split(placeholder)[0].split("<footer")[0]
+        markup = [layout]
+        if "{language_selector}" in layout:
+            markup.append(self.generate_index_language_selector(language))
+        if embedded_template_name:
+            # title and meta of the first article of an index page
+            markup.append(self.templates.get(embedded_template_name).source.split("{article.html}")[0])
+        markup.append(first_block(content))
+        return self.optimizer.critical(os.path.join("assets", self.config.css_file), "".join(markup), template_name)
+
+    def inline_critical_css(self, html, template_name, language, css_url, placeholder, embedded_template_name=None, content=""):
+        """Inline the critical css of a page in its head, its stylesheet is then loaded without blocking"""
+        if not self.optimizer.enabled:
+            return html
+        return self.optimizer.inline(html, css_url, self.critical_css(template_name, language, placeholder, embedded_template_name, content))
+
+    def critical_css_report(self):
+        """Critical css of every layout, for the report at the end of the build"""
+        for language, articles in self.articles_by_language.items():
+            if articles:
+                # article pages may have been rendered by the worker processes
+                self.critical_css(self.article_template_name(articles[0]), language, "{article.html}", content=articles[0].html)
+                self.critical_css(self.index_template_name(language), language, "{html_articles}", self.embedded_article_template_name(), self.index_page_content(language, 0))
+                tags = self.tag_index.tags(language)
+                self.critical_css(self.tag_template_name(language), language, "{tag_articles}", content=self.tag_articles_html(language, tags[0]) if tags else "")
+
+    def asset_path(self, name, page_path):
+        """Relative url of a file of assets/ from a page, under its hashed name"""
+        return os.path.relpath(os.path.join(self.config.html_dir, "assets", self.assets.name(name)), os.path.dirname(page_path))
+
+    def link_article_files(self, html, article, page_path):
+        """Point the asset urls of the rendered article to its published files, relative to the page"""
+        files_dir = os.path.join(self.config.html_dir, os.path.relpath(article.get_translations_dir(), self.config.md_dir))
+        return html.replace(ASSET_DIR_MARKER, os.path.relpath(files_dir, os.path.dirname(page_path)) + "/")
 
     # generate the main page for the site
     def generate_tag_pages(self):
@@ -255,47 +926,50 @@ class Website:
         
         for language in languages:
             # Create tags directory for this language
-            tags_dir = os.path.join(self.config.html_dir, language, "tags")
-            os.makedirs(tags_dir, exist_ok=True)
-            
-            # Group articles by tag for this specific language
-            articles_by_tag_lang = {}
-            if language in self.articles_by_language:
-                for article in self.articles_by_language[language]:
-                    for tag in article.tags:
-                        if tag not in articles_by_tag_lang:
-                            articles_by_tag_lang[tag] = []
-                        articles_by_tag_lang[tag].append(article)
-            
+            self.output.makedirs(os.path.join(self.config.html_dir, language, "tags"))
+
             # Generate a page for each tag in this language
-            for tag in articles_by_tag_lang:
-                articles = articles_by_tag_lang[tag]
-                tag_articles = ""
-                
-                # Build the list of articles for this tag
-                for article in articles:
-                    article_link = os.path.relpath(article.path, tags_dir)
-                    tag_articles += f'<p><a href="{article_link}">{article.title}</a> - {article.date}</p>'
-                
-                # Get top tags for this language
-                top_tags = self.sorted_tags_by_language.get(language, [])[:self.config.top_tags]
-                html_top_tags = "".join([f'<a href="{t}.html"><span class="meta-box tag-{i+1}">{t}</span></a>' for i, t in enumerate(top_tags)])
-                
-                # Use language-specific template
-                template_name = f"{language}-tag.html" if language != self.config.default_language else "tag.html"
-                try:
-                    html_template = self.get_template(template_name)
-                except FileNotFoundError:
-                    # Fallback to default template if language-specific template doesn't exist
-                    html_template = self.get_template("tag.html")
-                
-                tag_name = tag
-                rendered_html = eval(f"f'''{html_template}'''")
-                
+            for tag in self.tag_index.tags(language):
+                tag_file_path = self.tag_page_path(language, tag)
+                if not self.in_scope(tag_file_path) or not self.owns(f"tag:{language}:{tag}") or self.manifest.check(tag_file_path, *self.tag_page_dependencies(language, tag)):
+                    continue
                 # Write the tag page file
-                tag_file_path = os.path.join(tags_dir, f"{tag}.html")
-                with open(tag_file_path, 'w', encoding='utf-8') as f:
-                    f.write(rendered_html)
+                self.write_page(tag_file_path, self.render_tag_page(language, tag))
+
+    def tag_template_name(self, language):
+        return self.language_template_name(language, "tag.html")
+
+    def tag_page_path(self, language, tag):
+        return os.path.join(self.config.html_dir, language, "tags", f"{tag}.html")
+
+    def tag_page_dependencies(self, language, tag):
+        """Inputs and context a tag page depends on"""
+        top_tags = self.get_top_tags_by_language(language, self.config.top_tags)
+        # tag pages only show the title, date and link of their articles
+        context = "\n".join([",".join(top_tags)] + [f"{article.path}|{article.title}|{article.date}" for article in self.tag_index.get_articles(language, tag)])
+        return [self.template_path(self.tag_template_name(language)), "settings", "assets", "critical_css"], context
+
+    def tag_articles_html(self, language, tag):
+        """List of the articles of a tag, linked from its page"""
+        tags_dir = os.path.join(self.config.html_dir, language, "tags")
+        tag_articles = ""
+        for article in self.tag_index.get_articles(language, tag):
+            article_link = os.path.relpath(article.path, tags_dir)
+            tag_articles += f'<p><a href="{article_link}">{article.title}</a> - {article.date}</p>'
+        return tag_articles
+
+    def render_tag_page(self, language, tag):
+        """Html of the page listing the articles of a tag"""
+        tag_file_path = self.tag_page_path(language, tag)
+        css_path = self.asset_path(self.config.css_file, tag_file_path)
+        tag_articles = self.tag_articles_html(language, tag)
+        rendered_html = self.templates.render(self.tag_template_name(language),
+            css_path=css_path,
+            theme_toggle_path=self.asset_path("theme-toggle.js", tag_file_path),
+            tag_name=tag,
+            tag_articles=tag_articles,
+            html_top_tags=self.top_tags_html(language, ""))
+        return self.inline_critical_css(rendered_html, self.tag_template_name(language), language, css_path, "{tag_articles}", content=tag_articles)
 
     def generate_index(self):
         """Generate language-specific index pages"""
@@ -308,81 +982,204 @@ class Website:
     
     def generate_language_index(self, language):
         """Generate index pages for a specific language"""
-        if language not in self.articles_by_language:
-            return
-        
-        lang_articles = self.articles_by_language[language]
-        if not lang_articles:
+        if not self.articles_by_language.get(language):
             return
             
         # Create language directory
-        lang_dir = os.path.join(self.config.html_dir, language)
-        os.makedirs(lang_dir, exist_ok=True)
-        
-        total_pages = math.ceil(len(lang_articles) / self.config.nb_articles_per_page)
-        
-        for page in range(total_pages):
-            start = page * self.config.nb_articles_per_page
-            end = start + self.config.nb_articles_per_page
-            articles = lang_articles[start:end]
-            
-            page_title = f"Page {page+1} of {total_pages}" if total_pages > 1 else ""
-            html_articles = ""
-            template_name = "embedded_article.html" if self.config.get("show_full_content") else "embedded_article_summary.html"
-            html_template = self.get_template(template_name)
-            
-            # Language-specific CSS path
-            css_path = os.path.join("../assets", self.config.css_file)
-            
-            for article in articles:
-                # Calculate relative path from language index to article
-                subpath = os.path.relpath(article.path, lang_dir)
-                content = eval(f"f'''{html_template}'''")
-                
-                if self.config.get("show_full_content"):
-                    content = Website.update_image_paths(content, subpath)
-                html_articles += content
-                
-            # Language-specific navigation
-            link_prev = ""
-            link_next = ""
-            if page == 1:
-                link_prev = "index.html"
-            elif page > 1:
-                link_prev = f'index-{page-1}.html'
-            if page < total_pages - 1:
-                link_next = f'index-{page+1}.html'
+        self.output.makedirs(os.path.join(self.config.html_dir, language))
 
+        for page in range(self.index_page_count(language)):
+            html_file_path = self.index_page_path(language, page)
+            if not self.in_scope(html_file_path) or not self.owns(f"index:{language}:{page}") or self.manifest.check(html_file_path, *self.index_page_dependencies(language, page)):
+                continue
+            link_prev, link_next = self.index_page_links(language, page)
             print(f"Generating {language} index page {page} {link_prev=} {link_next=}")
-            
+            # the articles are written one by one between the two halves of the page
+            self.write_page_parts(html_file_path, self.render_index_page(language, page))
+
+    def index_template_name(self, language):
+        return self.language_template_name(language, "index.html")
+
+    def embedded_article_template_name(self):
+        return "embedded_article.html" if self.config.get("show_full_content") else "embedded_article_summary.html"
+
+    def index_page_count(self, language):
+        return math.ceil(len(self.articles_by_language.get(language, [])) / self.config.nb_articles_per_page)
+
+    def index_page_path(self, language, page):
+        # Save in language directory
+        return os.path.join(self.config.html_dir, language, "index.html" if page == 0 else f"index-{page}.html")
+
+    def index_page_articles(self, language, page):
+        start = page * self.config.nb_articles_per_page
+        return self.articles_by_language[language][start:start + self.config.nb_articles_per_page]
+
+    def index_page_links(self, language, page):
+        """Links to the previous and next index pages"""
+        link_prev = ""
+        link_next = ""
+        if page == 1:
+            link_prev = "index.html"
+        elif page > 1:
+            link_prev = f'index-{page-1}.html'
+        if page < self.index_page_count(language) - 1:
+            link_next = f'index-{page+1}.html'
+        return link_prev, link_next
+
+    def index_page_dependencies(self, language, page):
+        """Inputs and context an index page depends on"""
+        articles = self.index_page_articles(language, page)
+        link_prev, link_next = self.index_page_links(language, page)
+        lang_top_tags = self.get_top_tags_by_language(language, self.config.top_tags)
+        inputs = [self.template_path(self.index_template_name(language)), self.template_path(self.embedded_article_template_name()), "settings", "assets", "critical_css"]
+        inputs += [article.md_file_path for article in articles]
+        inputs += self.image_inputs() + [path for article in articles for path in self.image_files(article)]
+        context = "\n".join([str(self.index_page_count(language)), link_prev, link_next, ",".join(lang_top_tags), self.generate_index_language_selector(language)] + [article.path for article in articles])
+        return inputs, context
+
+    def render_index_page(self, language, page):
+        """Parts of an index page of a language, page 0 is index.html"""
+        html_file_path = self.index_page_path(language, page)
+        total_pages = self.index_page_count(language)
+        link_prev, link_next = self.index_page_links(language, page)
+        page_title = f"Page {page+1} of {total_pages}" if total_pages > 1 else ""
+
+        css_path = self.asset_path(self.config.css_file, html_file_path)
+
+        rendered_html = self.templates.render(self.index_template_name(language),
+            page_title=page_title,
+            css_path=css_path,
+            theme_toggle_path=self.asset_path("theme-toggle.js", html_file_path),
+            language_selector=self.generate_index_language_selector(language),
+            html_articles=PAGE_ARTICLES_MARKER,
             # Language-specific top tags
-            lang_top_tags = self.sorted_tags_by_language.get(language, [])[:self.config.top_tags]
+            html_top_tags=self.top_tags_html(language, "tags/"),
+            search_widget=self.generate_search_widget(language),
+            link_prev=link_prev,
+            link_next=link_next)
+        head, tail = rendered_html.split(PAGE_ARTICLES_MARKER)
+        head = self.inline_critical_css(head, self.index_template_name(language), language, css_path, "{html_articles}", self.embedded_article_template_name(), self.index_page_content(language, page))
+        return self.index_page_parts(html_file_path, language, head, self.index_page_articles(language, page), tail)
 
-            html_top_tags = "".join([f'<a href="tags/{tag}.html"><span class="meta-box tag-{i+1}">{tag}</span></a>' for i, tag in enumerate(lang_top_tags)])
+    def index_page_content(self, language, page):
+        """Body of the first article of an index page, when the articles are shown in full"""
+        articles = self.index_page_articles(language, page)
+        if not self.config.get("show_full_content") or not articles:
+            return ""
+        return articles[0].html
 
-            # Generate language selector for index
-            language_selector = self.generate_index_language_selector(language)
-            
-            if language == "fr":
-                html_template = self.get_template("index.html")
-            elif language == "en":
-                html_template = self.get_template("en-index.html")
-            else:
-                raise ValueError(f"language not supported : {language}")
-            
-            rendered_html = eval(f"f'''{html_template}'''")
-            
-            # Save in language directory
-            if page == 0:
-                html_file_path = os.path.join(lang_dir, "index.html")
-            else:
-                html_file_path = os.path.join(lang_dir, f"index-{page}.html")
+    def index_page_parts(self, html_file_path, language, head, articles, tail):
+        """Parts of an index page: the page around the articles, then each article"""
+        lang_dir = os.path.join(self.config.html_dir, language)
+        article_template = self.templates.get(self.embedded_article_template_name())
+        sizes = ARTICLE_IMAGE_SIZES if self.config.get("show_full_content") else THUMBNAIL_IMAGE_SIZES
+        rewrite = (lambda html: self.images.rewrite(html, language, sizes)) if self.images else (lambda html: html)
+        yield rewrite(head)
+        for article in articles:
+            # Calculate relative path from language index to article
+            subpath = os.path.relpath(article.path, lang_dir)
+            content = article_template.render(article=article, subpath=subpath)
             
-            with open(html_file_path, 'w', encoding='utf-8') as f:
-                f.write(rendered_html)
+            if self.config.get("show_full_content"):
+                content = self.link_article_files(content, article, html_file_path)
+            yield rewrite(content)
+        yield rewrite(tail)
     
+    def generate_search_index(self):
+        """Write the search index of each language, used by the search widget"""
+        if not self.search:
+            return
+        for lang in self.config.get('supported_languages') or ['fr', 'en']:
+            if self.articles_by_language.get(lang):
+                nb_files, nb_bytes = self.search.write(self.config.html_dir, lang, self.articles_by_language[lang])
+                self.profile.count_write(nb_bytes, nb_files)
+
+    def generate_search_widget(self, language):
+        """Search box of the index pages of a language"""
+        if not self.search:
+            return ""
+        placeholder, no_results = SEARCH_LABELS.get(language, SEARCH_LABELS["en"])
+        script_path = self.asset_path("search.js", os.path.join(self.config.html_dir, language, "index.html"))
+        return f"""
+                    <div class="search">
+                        <input type="search" id="search-input" placeholder="{placeholder}" aria-label="{placeholder}" autocomplete="off">
+                        <div id="search-results"></div>
+                        <script src="{script_path}" data-index="../search/{language}/" data-root="../" data-empty="{no_results}" defer></script>
+                    </div>"""
+
+    def url(self, path):
+        """Absolute url of a path of the html dir"""
+        return f"{self.config.site_url}/{quote(os.path.relpath(path, self.config.html_dir).replace(os.sep, '/'))}"
+
+    def article_url(self, article):
+        return self.url(os.path.dirname(article.path)) + "/"
+
+    def generate_feeds(self, content_dates=None):
+        """Write the Atom feeds of each language and tag and the sitemaps, dated by the content of the articles"""
+        self.content_dates.start(content_dates)
+        host = urlparse(self.config.site_url).netloc
+        sitemaps = []
+        for lang in self.config.get('supported_languages') or ['fr', 'en']:
+            articles = self.articles_by_language.get(lang)
+            if not articles:
+                continue
+            lang_dir = os.path.join(self.config.html_dir, lang)
+            self.write_feed(os.path.join(lang_dir, "feed.xml"), host, self.url(lang_dir) + "/", lang, articles)
+            for tag in self.tag_index.tags(lang):
+                tag_path = os.path.join(lang_dir, "tags", f"{tag}.html")
+                self.write_feed(os.path.join(lang_dir, "tags", f"{tag}.xml"), f"{host} - {tag}", self.url(tag_path), lang, self.tag_index.get_articles(lang, tag))
+            sitemaps += self.write_sitemaps(lang, articles)
+        path = os.path.join(self.config.html_dir, "sitemap.xml")
+        self.write_generated(path, "\n".join(f"{url}|{lastmod}" for url, lastmod in sitemaps), sitemap_index(sitemaps))
+        self.content_dates.save()
+
+    def write_feed(self, path, title, page_url, language, articles):
+        """Atom feed of the latest articles of a list sorted by date"""
+        entries = [(self.article_url(article), article.title, iso_datetime(article.date), self.content_dates.updated(article), article.abstract, article.tags)
+                   for article in articles[:self.config.feed_entries]]
+        context = json.dumps([title, page_url, entries], ensure_ascii=False, default=str)
+        self.write_generated(path, context, atom_feed(title, self.url(path), page_url, language, self.config.site_author, entries))
+
+    def write_sitemaps(self, language, articles):
+        """Sitemaps of a language with the hreflang alternates of the articles, return their urls and lastmod"""
+        lang_dir = os.path.join(self.config.html_dir, language)
+        updated = {article.md_file_path: self.content_dates.updated(article) for article in articles}
+        urls = [(self.url(lang_dir) + "/", max(updated.values()), [])]
+        for article in articles:
+            alternates = self.hreflang_urls(self.get_translations(article))
+            urls.append((self.article_url(article), updated[article.md_file_path], alternates if len(alternates) > 1 else []))
+        for tag in self.tag_index.tags(language):
+            tag_updated = max(updated[article.md_file_path] for article in self.tag_index.get_articles(language, tag))
+            urls.append((self.url(os.path.join(lang_dir, "tags", f"{tag}.html")), tag_updated, []))
+
+        sitemaps = []
+        for i in range(0, len(urls), SITEMAP_MAX_URLS):
+            chunk = urls[i:i + SITEMAP_MAX_URLS]
+            name = f"sitemap-{language}.xml" if i == 0 else f"sitemap-{language}-{i // SITEMAP_MAX_URLS}.xml"
+            path = os.path.join(self.config.html_dir, name)
+            # the entries are hashed one by one, the document is only built while it is written
+            h = hashlib.sha256()
+            for url in chunk:
+                h.update(repr(url).encode("utf-8"))
+            self.write_generated(path, h.hexdigest(), sitemap(chunk))
+            sitemaps.append((self.url(path), max(lastmod for url, lastmod, alternates in chunk)))
+        return sitemaps
+
+    def write_generated(self, path, context, parts):
+        """Stream a generated file to disk unless it is up to date"""
+        if self.manifest.check(path, ["settings"], context):
+            return
+        self.output.makedirs(os.path.dirname(path))
+        self.write_page_parts(path, parts)
+
     def generate_root_index(self):
         """Generate root index that redirects to default language"""
+        root_index_path = os.path.join(self.config.html_dir, "index.html")
+        if not self.owns("site") or self.manifest.check(root_index_path, ["settings"]):
+            return
+        self.write_page(root_index_path, self.render_root_index())
+
+    def render_root_index(self):
         default_lang = self.config.get('default_language') or 'fr'
         
         # Simple redirect page
@@ -397,10 +1194,7 @@ class Website:
     <p>Redirecting to <a href="/{default_lang}/">main site</a>...</p>
 </body>
 </html>'''
-        
-        root_index_path = os.path.join(self.config.html_dir, "index.html")
-        with open(root_index_path, 'w', encoding='utf-8') as f:
-            f.write(redirect_html)
+        return redirect_html
     
     def generate_index_language_selector(self, current_language):
         """Generate language selector for index pages"""
@@ -416,29 +1210,20 @@ class Website:
         
         return " | ".join(selector_links)
 
+    def hreflang_urls(self, translations):
+        """Language and url of each variant of an article, like https://example.com/fr/2025/11/10/floating-point/"""
+        site_url = self.config.get('site_url')
+        return [(lang, f"{site_url}/{quote(f'{lang}/{url_path}/')}") for lang, (md_file, url_path) in translations.items() if url_path is not None]
+
     def generate_hreflang_links(self, article, translations):
         """Generate hreflang links for multilingual SEO"""
-        hreflang_links = []
-        site_url = self.config.get('site_url')
-        
-        for lang, translation_path in translations.items():
-            # Generate URL: https://example.com/fr/2025/11/10/floating-point/
-            rel_path = translation_path.replace(self.config.md_dir + "/", "")
-            path_parts = rel_path.split("/")
-            if len(path_parts) >= 4:  # year/month/day/article/lang.md
-                article_path = "/".join(path_parts[:-1])  # remove lang.md
-                url = f"{site_url}/{lang}/{article_path}/"
-                hreflang_links.append(f'<link rel="alternate" hreflang="{lang}" href="{url}" />')
+        urls = self.hreflang_urls(translations)
+        hreflang_links = [f'<link rel="alternate" hreflang="{lang}" href="{url}" />' for lang, url in urls]
         
         # Add canonical link (prefer original language or default)
-        canonical_lang = article.language
-        if canonical_lang in translations:
-            rel_path = translations[canonical_lang].replace(self.config.md_dir + "/", "")
-            path_parts = rel_path.split("/")
-            if len(path_parts) >= 4:
-                article_path = "/".join(path_parts[:-1])
-                canonical_url = f"{site_url}/{canonical_lang}/{article_path}/"
-                hreflang_links.append(f'<link rel="canonical" href="{canonical_url}" />')
+        canonical_url = dict(urls).get(article.language)
+        if canonical_url:
+            hreflang_links.append(f'<link rel="canonical" href="{canonical_url}" />')
         
         return "\n".join(hreflang_links)
     
@@ -448,34 +1233,107 @@ class Website:
         selector_links = []
         
         for lang in self.config.get('supported_languages') or ['fr', 'en']:
-            if lang in translations:
+            if lang in translations and translations[lang][1] is not None:
                 # Calculate relative URL to other language version  
                 # From /lang/2025/11/10/article/ to /lang/2025/11/10/article/
-                rel_path = translations[lang].replace(self.config.md_dir + "/", "")
-                path_parts = rel_path.split("/")
-                if len(path_parts) >= 4:
-                    article_path = "/".join(path_parts[:-1])  # remove lang.md
-                    lang_url = f"../../../../../{lang}/{article_path}/"
-                    flag = language_flags.get(lang, lang.upper())
-                    is_current = lang == article.language
-                    css_class = 'lang-current' if is_current else 'lang-link'
-                    selector_links.append(f"""<a href="{lang_url}" onclick="document.cookie='lang={lang}; path=/; max-age='+(60*60*24*365)" class="{css_class}">{flag} {lang.upper()}</a>""")
+                lang_url = f"../../../../../{lang}/{translations[lang][1]}/"
+                flag = language_flags.get(lang, lang.upper())
+                is_current = lang == article.language
+                css_class = 'lang-current' if is_current else 'lang-link'
+                selector_links.append(f"""<a href="{lang_url}" onclick="document.cookie='lang={lang}; path=/; max-age='+(60*60*24*365)" class="{css_class}">{flag} {lang.upper()}</a>""")
         
         return " | ".join(selector_links)
 
     
 
-if __name__ == "__main__":
-    conf = Configuration()
-    www = Website(conf)
-    www.init_html()
-    www.init_articles()
+# website and highlight cache used by the worker processes of a parallel build
+worker_website = None
+worker_highlights = None
 
-    www.generate_index()
+def init_worker(website):
+    global worker_website
+    worker_website = website
+    init_renderer(website.config.markdown_renderer, website.highlights.reader() if website.highlights else None)
 
-    www.generate_tag_pages()
+def init_renderer(renderer_name, highlights):
+    global worker_highlights
+    worker_highlights = highlights
+    renderers.use(renderer_name)
+    highlight.install(highlights)
 
-    for article in www.articles:
-        print(f"Generating html for article {article.title}")
-        www.generate_html_article(article)
-            
+def render_article(article):
+    # only the body, the snippet is rendered by the main process if a page uses it
+    html = article.html
+    # code blocks highlighted by this worker, stored by the main process
+    highlights = worker_highlights.drain() if worker_highlights else None
+    return html, article.markdown_time, highlights
+
+def write_html_article(article):
+    start = time.perf_counter()
+    output = worker_website.output
+    nb_written = output.nb_written
+    nb_bytes = worker_website.write_html_article(article)
+    # the page is on disk before the main process counts it
+    output.flush()
+    return time.perf_counter() - start, nb_bytes, output.nb_written > nb_written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the website from the markdown articles")
+    parser.add_argument("command", nargs="?", choices=["build", "serve", "snapshot", "merge"], default="build",
+                        help="build the website (default), serve a preview rendered on demand, write the metadata snapshot of a sharded build or merge its shards")
+    parser.add_argument("--incremental", action="store_true", help="only regenerate the files whose inputs changed since the last build")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of processes used to parse and render the articles (0: one per core)")
+    parser.add_argument("--no-cache", action="store_true", help="parse every article again instead of using the article cache")
+    parser.add_argument("--precompress", action="store_true", help="write .gz (and .br) copies of the compressible files, same as PRECOMPRESS=true")
+    parser.add_argument("--watch", action="store_true", help="keep running and rebuild the pages affected by each change of the sources")
+    parser.add_argument("--low-memory", action="store_true", help="keep only compact records of the articles and read their bodies again when needed, same as LOW_MEMORY=true")
+    parser.add_argument("--profile", action="store_true", help="time each stage and each article, write .cache/build-profile.json and print the slowest articles")
+    parser.add_argument("--profile-top", type=int, default=10, metavar="N", help="number of articles in the table of the slowest ones (default 10)")
+    parser.add_argument("--host", default="127.0.0.1", help="address of the preview server (default 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="port of the preview server (default 8000)")
+    parser.add_argument("--shard", type=parse_shard, metavar="i/N", help="only build shard i of N (from 0), into SHARDS_DIR/i-of-N, after website.py snapshot")
+    parser.add_argument("--shards", type=int, metavar="N", help="number of shards of the build to merge")
+    parser.add_argument("--cprofile", metavar="FILE", help="dump cProfile stats of the whole run (this process only) to FILE, for pstats or snakeviz")
+    args = parser.parse_args()
+
+    conf = Configuration()
+    conf.precompress = conf.precompress or args.precompress
+    if args.shard:
+        if args.command != "build" or args.watch:
+            parser.error("--shard only applies to a build")
+        index, count = args.shard
+        conf.html_dir = os.path.join(shard_dir(conf.shards_dir, index, count), "html")
+        # shards have their own manifest and caches, they can run at the same time on one machine
+        conf.cache_dir = os.path.join(conf.cache_dir, "shards", f"{index}-of-{count}")
+        # compressed copies are written by the merge
+        conf.precompress = False
+    if args.command == "merge" and not args.shards:
+        parser.error("merge needs --shards N")
+    if args.command == "serve":
+        # pages are only rendered in memory, the image variants, search index, hashed and minified copies of the assets are not published
+        conf.responsive_images = conf.search_index = conf.fingerprint_assets = conf.optimize_assets = False
+    www = Website(conf, incremental=args.incremental, jobs=args.jobs or os.cpu_count(), use_cache=not args.no_cache, profile=args.profile, profile_top=args.profile_top, low_memory=args.low_memory, shard=args.shard)
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler:
+        profiler.enable()
+    try:
+        if args.command == "serve":
+            PreviewServer(www).run(args.host, args.port)
+        elif args.command == "snapshot":
+            www.write_snapshot()
+        elif args.command == "merge":
+            problems = www.merge(args.shards)
+            for problem in problems:
+                print(problem)
+            if problems:
+                raise SystemExit(f"merge failed: {len(problems)} problems, nothing was written")
+        elif args.watch:
+            www.watch()
+        else:
+            www.build()
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+            print(f"cProfile stats written to {args.cprofile}")